@@ -0,0 +1,288 @@
+"""
+Benchmarks of main.py and main_with_5.py on random cohorts from random_data_generator.py.
+
+Each case runs in its own process (so that peak memory is measured per case) and records the wall time of each phase,
+the number of DP states per row, the peak memory and the objective value. Results are written as JSON, and compared
+against a stored baseline (see README).
+
+Usage: python benchmark.py [--suite quick|full] [--output FILE] [--baseline FILE] [--update-baseline]
+"""
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource  # Only available on Unix, peak memory is not measured otherwise
+except ImportError:
+    resource = None
+
+import random_data_generator
+from main import NEGATIVE_INFINITY
+
+BASELINE_FILENAME = 'benchmark_baseline.json'
+RESULTS_FILENAME = 'benchmark_results.json'
+
+# Regression thresholds: a case regresses if it gets slower than TIME_TOLERANCE times its baseline time
+# (and by at least TIME_SLACK seconds, to ignore noise on short cases), uses more than MEMORY_TOLERANCE times its
+# baseline peak memory, keeps more than STATES_TOLERANCE times its baseline number of DP states,
+# or finds a different objective value
+TIME_TOLERANCE = 1.5
+TIME_SLACK = 0.5
+MEMORY_TOLERANCE = 1.25
+STATES_TOLERANCE = 1.1
+
+PHASES = ['parse', 'dp', 'find_maxima', 'traceback', 'output']
+
+
+def make_case(program='main', students=150, options=9, pair_prob=0.5, non_specified_prob=0.05, skip_prob=0.05,
+              seed=0, params=None):
+    """
+    Describe one benchmark case.
+    :param program: 'main' or 'main_with_5'
+    :param students: Number of students
+    :param options: Number of topic options, including "non-specified"
+    :param pair_prob: Probability that a student submits with a partner
+    :param non_specified_prob: Probability of "non-specified" as each choice
+    :param skip_prob: Probability that a student (or pair) does not submit preferences
+    :param seed: Random seed of both the generated cohort and the DP
+    :param params: Dict of parameters of the program to override (e.g. {'DP_ENGINE': 'numpy'})
+    :return: Case as a dict (with a name that identifies it in results and baselines)
+    """
+    params = params or {}
+    name = '%s-n%d-t%d-p%g-ns%g-s%g-seed%d' % (program, students, options, pair_prob, non_specified_prob, skip_prob,
+                                               seed)
+    name += ''.join('-%s=%s' % (key, params[key]) for key in sorted(params))
+    return {
+        'name': name, 'program': program, 'students': students, 'options': options, 'pair_prob': pair_prob,
+        'non_specified_prob': non_specified_prob, 'skip_prob': skip_prob, 'seed': seed, 'params': params,
+    }
+
+
+def quick_suite():
+    """
+    Small cases that run in a few minutes in total, used for the stored baseline.
+    """
+    numpy = {'DP_ENGINE': 'numpy'}
+    return [
+        make_case(students=50),
+        make_case(students=150, params=numpy),
+        make_case(students=300, params=numpy),
+        make_case(students=60, options=7),
+        make_case(students=25, options=13, params={'PRUNE_STATES': True}),
+        make_case(students=150, pair_prob=0.9, params=numpy),
+        make_case(students=150, non_specified_prob=0.3, params=numpy),
+        make_case(students=150, skip_prob=0.3, params=numpy),
+        make_case(students=80, params={'PRUNE_STATES': True}),
+        make_case(students=150, params={'SOLVER': 'classes'}),
+        make_case(program='main_with_5', students=20),
+        make_case(students=40, options=13, params={'DP_ENGINE': 'sparse', 'GROUP_ORDER': 'stratified'}),
+    ]
+
+
+def full_suite():
+    """
+    Sweeps over each property of the cohort, up to 1000 students and 12 topics.
+    """
+    numpy = {'DP_ENGINE': 'numpy'}
+    cases = [make_case(students=n, params=numpy) for n in [50, 100, 150, 300, 500, 750, 1000]]
+    cases += [make_case(students=40, options=t + 1, params={'PRUNE_STATES': True}) for t in range(6, 13)]
+    cases += [make_case(students=150, pair_prob=p, params=numpy) for p in [0, 0.25, 0.5, 0.75, 1]]
+    cases += [make_case(students=150, non_specified_prob=p, params=numpy) for p in [0, 0.1, 0.3, 0.6]]
+    cases += [make_case(students=150, skip_prob=p, params=numpy) for p in [0, 0.1, 0.3, 0.6]]
+    cases += [make_case(students=n, params={'SOLVER': 'classes'}) for n in [150, 500, 1000]]
+    cases += [make_case(program='main_with_5', students=n) for n in [15, 20, 25]]
+    cases += [make_case(students=40, options=t + 1, params={'DP_ENGINE': 'sparse', 'GROUP_ORDER': 'stratified'})
+              for t in range(6, 13)]
+    return cases
+
+
+SUITES = {'quick': quick_suite, 'full': full_suite}
+
+
+def count_states(alloc_row):
+    """
+    Number of reachable states in a row of the decision table, whichever way it is stored.
+    """
+    if isinstance(alloc_row, dict):
+        return len(alloc_row)
+    if hasattr(alloc_row, 'states'):  # CompactDecisionRow
+        return len(alloc_row.states)
+    return int((alloc_row.decisions >= 0).sum())  # DenseDecisionRow
+
+
+def run_case(case):
+    """
+    Run one case in this process.
+    :return: Dict of results
+    """
+    workdir = tempfile.mkdtemp(prefix='benchmark-')
+    netid_filename = os.path.join(workdir, 'netids.txt')
+    pref_filename = os.path.join(workdir, 'prefs.txt')
+    output_filename = os.path.join(workdir, 'output.txt')
+    # Option 0 is "non-specified", the rest are skewed like in random_data_generator.py
+    topic_distr = [0] + [2 ** -(i // 2) for i in range(case['options'] - 1)]
+    topic_distr[0] = case['non_specified_prob'] * sum(topic_distr) / (1 - case['non_specified_prob'])
+    random_data_generator.generate(netid_filename, pref_filename, num_students=case['students'],
+                                   num_topics=case['options'], topic_distr=topic_distr,
+                                   find_group_prob=case['pair_prob'], ignore_prob=case['skip_prob'],
+                                   seed=case['seed'])
+
+    m = importlib.import_module(case['program'])
+    make_allocator = getattr(m, 'make_allocator', getattr(m, 'Allocator', None))  # main_with_5.py configures main.py
+    solver = make_allocator(num_options=case['options'],
+                            **{key.lower(): value for key, value in case['params'].items()})
+    rng = solver.random
+    times = {}
+    result = {'case': case}
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        solver.read_netids(netid_filename)
+        solver.read_prefs(pref_filename)
+        times['parse'] = time.perf_counter() - start
+        rng.seed(case['seed'])
+
+        if getattr(solver, 'solver', 'dp') == 'classes':
+            # No DP table: the whole solve counts as the DP phase
+            start = time.perf_counter()
+            solver.precompute_group_values()
+            max_value, project_groups = solver.solve_classes()
+            times['dp'] = time.perf_counter() - start
+            times['find_maxima'] = times['traceback'] = 0.0
+            result['states_per_row'] = []
+        else:
+            start = time.perf_counter()
+            solver.shuffle_groups()
+            if hasattr(solver, 'precompute_group_values'):
+                solver.precompute_group_values()
+            solver.dp()
+            times['dp'] = time.perf_counter() - start
+            result['states_per_row'] = [count_states(row) for row in solver.alloc if row is not None]
+
+            start = time.perf_counter()
+            max_states, max_value = solver.find_maxima()
+            times['find_maxima'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            project_groups = solver.traceback(rng.choice(max_states)) if max_states else []
+            times['traceback'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        solver.output(project_groups, output_filename)
+        times['output'] = time.perf_counter() - start
+
+    result['preference_groups'] = len(solver.groups)
+    result['times'] = times
+    result['total_time'] = sum(times.values())
+    result['max_states'] = max(result['states_per_row'], default=0)
+    result['total_states'] = sum(result['states_per_row'])
+    result['objective'] = int(max_value) if max_value > NEGATIVE_INFINITY else None
+    # ru_maxrss is in KB on Linux
+    result['peak_memory_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 if resource else None
+    return result
+
+
+def run_suite(cases):
+    """
+    Run each case in a separate process, and print a line per case.
+    :return: Dict mapping case names to results
+    """
+    results = {}
+    for case in cases:
+        process = subprocess.run([sys.executable, os.path.abspath(__file__), '--case', json.dumps(case)],
+                                 capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        if process.returncode != 0:
+            print('%s: FAILED\n%s' % (case['name'], process.stderr))
+            results[case['name']] = {'case': case, 'error': process.stderr.strip().split('\n')[-1]}
+            continue
+        result = json.loads(process.stdout)
+        results[case['name']] = result
+        print('%s: %.2fs (dp %.2fs), %d max states, %s MB, objective %s' % (
+            case['name'], result['total_time'], result['times']['dp'], result['max_states'],
+            '%.0f' % result['peak_memory_mb'] if result['peak_memory_mb'] is not None else '?', result['objective']))
+    return results
+
+
+def compare(results, baseline):
+    """
+    Compare results against a baseline.
+    :return: List of regression messages (empty if none)
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        old = baseline[name]
+        if 'error' in result:
+            if 'error' not in old:
+                regressions.append('%s: fails (%s)' % (name, result['error']))
+            continue
+        if 'error' in old:
+            continue
+        if result['objective'] != old['objective']:
+            regressions.append('%s: objective %s, baseline %s' % (name, result['objective'], old['objective']))
+        for phase in ['total'] + PHASES:
+            new_time = result['total_time'] if phase == 'total' else result['times'][phase]
+            old_time = old['total_time'] if phase == 'total' else old['times'][phase]
+            if new_time > old_time * TIME_TOLERANCE and new_time > old_time + TIME_SLACK:
+                regressions.append('%s: %s time %.2fs, baseline %.2fs' % (name, phase, new_time, old_time))
+        if result['max_states'] > old['max_states'] * STATES_TOLERANCE:
+            regressions.append('%s: %d max states per row, baseline %d' % (name, result['max_states'],
+                                                                          old['max_states']))
+        if (result['peak_memory_mb'] is not None and old['peak_memory_mb'] is not None
+                and result['peak_memory_mb'] > old['peak_memory_mb'] * MEMORY_TOLERANCE):
+            regressions.append('%s: peak memory %.0f MB, baseline %.0f MB' % (name, result['peak_memory_mb'],
+                                                                             old['peak_memory_mb']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark main.py and main_with_5.py on random cohorts.')
+    parser.add_argument('--suite', choices=sorted(SUITES), default='quick', help='Cases to run (default: quick)')
+    parser.add_argument('--output', default=RESULTS_FILENAME, help='Results file (default: %(default)s)')
+    parser.add_argument('--baseline', default=BASELINE_FILENAME, help='Baseline file (default: %(default)s)')
+    parser.add_argument('--update-baseline', action='store_true', help='Store the results as the new baseline')
+    parser.add_argument('--case', help=argparse.SUPPRESS)  # Internal: run one case, print its results as JSON
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(json.loads(args.case))))
+        return
+
+    results = run_suite(SUITES[args.suite]())
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+    print('Results written to %s.' % args.output)
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=1, sort_keys=True)
+        print('Baseline written to %s.' % args.baseline)
+        return
+
+    if not os.path.exists(args.baseline):
+        print('No baseline found at %s, nothing to compare.' % args.baseline)
+        return
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f))
+    if regressions:
+        print('Regressions against %s:' % args.baseline)
+        for message in regressions:
+            print('  ' + message)
+        sys.exit(1)
+    print('No regressions against %s.' % args.baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+"""
+Checks main.py against brute force on small random rosters, for every group size configuration that main.Allocator
+accepts (with GROUP_SIZE up to MAX_CHECKED_GROUP_SIZE).
+
+For each roster, every assignment of preference groups to topics is tried, and the people of each topic are split into
+project groups in the best way, which gives the true optimum. Then, for each variant of the DP, every allocation must
+be valid (group sizes, allowed topics, each preference group exactly once), score what it reports, and not beat the
+optimum, and the DP engines must report consistent row stats. The exact solver (SOLVER = 'classes') must find the optimum itself, and upper_bound() must not be below it;
+both only for even GROUP_SIZE (the solver rejects odd ones, and there is no bound).
+
+Usage: python brute_force_check.py [--rosters N] [--seed SEED]
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import random
+import sys
+from functools import lru_cache
+
+import main as allocation
+from main import NEGATIVE_INFINITY
+
+MAX_CHECKED_GROUP_SIZE = 6
+# Largest number of preference groups of a roster with 1, 2 or 3 topics (brute force tries topics ** groups assignments)
+MAX_ROSTER_GROUPS = {1: 16, 2: 11, 3: 8}
+# PREF_VALUES of the rosters in turn, including tied values (several best topics for one preference group)
+PREF_VALUE_SETS = [[8, 6, 3], [8, 8, 3], [5, 5, 5]]
+
+DP_VARIANTS = {
+    'dict': {},
+    'numpy': {'dp_engine': 'numpy'},
+    'sparse': {'dp_engine': 'sparse', 'group_order': 'stratified'},
+    'prune_states': {'prune_states': True},
+    'low_memory': {'low_memory': True},
+    'recompute_traceback': {'recompute_traceback': True},
+    'gap_tolerance': {'gap_tolerance': 0},  # The default: stops once a trial reaches the upper bound
+}
+
+
+def group_size_configs():
+    """
+    All (GROUP_SIZE, MIN_GROUP_SIZE, MAX_GROUP_SIZE) that main.Allocator accepts, up to MAX_CHECKED_GROUP_SIZE.
+    """
+    return [(group_size, min_group_size, max_group_size) for group_size in range(1, MAX_CHECKED_GROUP_SIZE + 1)
+            for min_group_size in range(1, group_size + 1) for max_group_size in (group_size, group_size + 1)]
+
+
+def random_roster(rng, num_topics):
+    """
+    Random preference groups (singles and pairs) and their preferences, some of them "non-specified".
+    :return: 3-tuple (netids, groups, prefs), as in main.Allocator
+    """
+    groups, prefs = [], []
+    num_people = 0
+    for _ in range(rng.randint(3, MAX_ROSTER_GROUPS[num_topics])):
+        size = rng.choice([1, 1, 2])
+        groups.append(list(range(num_people, num_people + size)))
+        num_people += size
+        r = rng.random()
+        if r < 0.15:  # No preferences submitted
+            prefs.append([-1])
+        elif r < 0.3:  # "Non-specified" as the second choice
+            prefs.append([rng.randrange(num_topics), -1, rng.randrange(num_topics)])
+        else:
+            prefs.append(rng.sample(range(num_topics), min(num_topics, rng.choice([2, 3]))))
+    return [str(person) for person in range(num_people)], groups, prefs
+
+
+def make_allocator(config, num_topics, roster, **params):
+    """
+    Allocator with a group size configuration and a roster (without reading files).
+    """
+    group_size, min_group_size, max_group_size = config
+    allocator = allocation.Allocator(group_size=group_size, min_group_size=min_group_size,
+                                     max_group_size=max_group_size, num_options=num_topics + 1,
+                                     enable_non_specified=True, non_specified_choice=num_topics + 1, **params)
+    allocator.netids, allocator.groups, allocator.prefs = roster
+    allocator.precompute_group_values()
+    return allocator
+
+
+def brute_force(allocator):
+    """
+    True optimum of the allocator's roster, by trying every assignment of preference groups to topics.
+    :return: Objective value, or NEGATIVE_INFINITY if there are no feasible allocations
+    """
+    @lru_cache(maxsize=None)
+    def best_split(singles, pairs):  # Best total penalty of splitting one topic's people into project groups
+        if singles == 0 and pairs == 0:
+            return 0
+        best = NEGATIVE_INFINITY
+        for num_pairs in range(pairs + 1):
+            for num_singles in range(singles + 1):
+                size = num_singles + 2 * num_pairs
+                if size == 0 or not allocator.min_group_size <= size <= allocator.max_group_size:
+                    continue
+                rest = best_split(singles - num_singles, pairs - num_pairs)
+                if rest != NEGATIVE_INFINITY:
+                    best = max(best, rest + (allocator.odd_size_group_penalty if size != allocator.group_size else 0))
+        return best
+
+    best = NEGATIVE_INFINITY
+    for assignment in itertools.product(range(allocator.num_topics), repeat=len(allocator.groups)):
+        values = [allocator.group_values[group][topic] for group, topic in enumerate(assignment)]
+        if NEGATIVE_INFINITY in values:
+            continue
+        total = sum(values)
+        for topic in range(allocator.num_topics):
+            sizes = [len(allocator.groups[group]) for group in range(len(allocator.groups)) if assignment[group] == topic]
+            penalty = best_split(sizes.count(1), sizes.count(2))
+            total = NEGATIVE_INFINITY if penalty == NEGATIVE_INFINITY else total + penalty
+            if total == NEGATIVE_INFINITY:
+                break
+        best = max(best, total)
+    return best
+
+
+def score(allocator, project_groups):
+    """
+    Objective value of an allocation of the allocator's roster, checking that it is valid.
+    :return: Objective value, or a description of what makes it invalid
+    """
+    allocator.precompute_group_values()  # solve() leaves the groups in the order of its best allocation
+    total = 0
+    allocated = []
+    for members, topic in project_groups:
+        size = sum(len(allocator.groups[group]) for group in members)
+        if not allocator.min_group_size <= size <= allocator.max_group_size:
+            return 'group of %d people' % size
+        for group in members:
+            if allocator.group_values[group][topic] == NEGATIVE_INFINITY:
+                return 'preference group %d on topic %d' % (group, topic)
+            total += allocator.group_values[group][topic]
+        total += allocator.odd_size_group_penalty if size != allocator.group_size else 0
+        allocated += members
+    if sorted(allocated) != list(range(len(allocator.groups))):
+        return 'preference groups missing or allocated twice'
+    return total
+
+
+def check_row_stats(config, num_topics, roster, seed, pref_values):
+    """
+    Check the row stats that each DP engine reports: every engine tries the same transitions (without retired topics,
+    which only the dict and sparse engines merge), and a row has no more states than accepted transitions, and no more
+    accepted transitions than attempted ones.
+    :return: List of failure messages
+    """
+    failures = []
+    attempted = {}
+    for engine in ('dict', 'numpy', 'sparse'):
+        if engine != 'dict' and allocation.np is None:
+            continue
+        rows = []
+        allocator = make_allocator(config, num_topics, roster, pref_values=pref_values, dp_engine=engine,
+                                   gap_tolerance=None, retire_topics=False, progress_callback=rows.append)
+        with contextlib.redirect_stdout(io.StringIO()):
+            allocator.solve(1, seed)
+        attempted[engine] = [row['transitions_attempted'] for row in rows]
+        for row in rows:
+            if not row['states'] <= row['transitions_accepted'] <= row['transitions_attempted']:
+                failures.append('%s row stats: %d states, %d accepted, %d attempted' % (
+                    engine, row['states'], row['transitions_accepted'], row['transitions_attempted']))
+    if len(set(map(tuple, attempted.values()))) > 1:
+        failures.append('attempted transitions differ between engines: %s' % attempted)
+    return failures
+
+
+def check_roster(config, num_topics, roster, seed, pref_values):
+    """
+    Check every DP variant, the exact solver and the upper bound on one roster.
+    :return: List of failure messages
+    """
+    optimum = brute_force(make_allocator(config, num_topics, roster, pref_values=pref_values))
+    failures = check_row_stats(config, num_topics, roster, seed, pref_values)
+    for name, params in DP_VARIANTS.items():
+        if params.get('dp_engine') in ('numpy', 'sparse') and allocation.np is None:
+            continue
+        allocator = make_allocator(config, num_topics, roster, pref_values=pref_values, **dict({'gap_tolerance': None}, **params))
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                value = allocator.solve(2, seed)
+        except Exception as e:
+            failures.append('%s: %s: %s' % (name, type(e).__name__, e))
+            continue
+        if value == NEGATIVE_INFINITY:  # The DP may miss feasible allocations, like any other better ones
+            continue
+        actual = score(allocator, allocator.project_groups)
+        if actual != value:
+            failures.append('%s: reports %s, but its allocation scores %s' % (name, value, actual))
+        elif value > optimum:
+            failures.append('%s: reports %s, above the optimum %s' % (name, value, optimum))
+
+    bound = make_allocator(config, num_topics, roster, pref_values=pref_values).upper_bound()
+    if config[0] % 2 != 0:  # The exact solver, and so the bound, needs an even GROUP_SIZE
+        if bound is not None:
+            failures.append('bound: %s for an odd GROUP_SIZE' % bound)
+        try:
+            make_allocator(config, num_topics, roster, pref_values=pref_values, solver='classes')
+            failures.append('classes: accepts an odd GROUP_SIZE')
+        except ValueError:
+            pass
+        return failures
+    if bound is None or bound < optimum:
+        failures.append('bound: %s, below the optimum %s' % (bound, optimum))
+    allocator = make_allocator(config, num_topics, roster, pref_values=pref_values, solver='classes', gap_tolerance=None)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            value = allocator.solve(1, seed)
+    except Exception as e:
+        return failures + ['classes: %s: %s' % (type(e).__name__, e)]
+    actual = score(allocator, allocator.project_groups) if value != NEGATIVE_INFINITY else value
+    if actual != value:
+        failures.append('classes: reports %s, but its allocation scores %s' % (value, actual))
+    elif value != optimum:
+        failures.append('classes: reports %s, but the optimum is %s' % (value, optimum))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check main.py against brute force on small random rosters.')
+    parser.add_argument('--rosters', type=int, default=50, help='Rosters per configuration (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of the rosters (default: %(default)s)')
+    args = parser.parse_args()
+
+    num_failures = 0
+    for config in group_size_configs():
+        rng = random.Random('%d-%s' % (args.seed, config))
+        config_failures = 0
+        for i in range(args.rosters):
+            num_topics = i % 3 + 1
+            pref_values = PREF_VALUE_SETS[i // 3 % len(PREF_VALUE_SETS)]
+            roster = random_roster(rng, num_topics)
+            for message in check_roster(config, num_topics, roster, i, pref_values):
+                print('GROUP_SIZE, MIN_GROUP_SIZE, MAX_GROUP_SIZE = %s, PREF_VALUES = %s, roster %d: %s'
+                      % (config, pref_values, i, message))
+                config_failures += 1
+        print('%s: %s' % (config, 'OK' if config_failures == 0 else '%d failures' % config_failures))
+        num_failures += config_failures
+    if num_failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,40 @@
+import asyncio
+import cProfile
+import hashlib
+import heapq
+import itertools
+import json
+import math
+import mmap
+import multiprocessing
+import os
+import queue
 import random
+import signal
+import struct
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from contextlib import contextmanager
+from array import array
+from bisect import bisect_left
+
+try:
+    import numpy as np  # Only needed for DP_ENGINE = 'numpy'
+except ImportError:
+    np = None
 
 NETID_FILENAME = 'nets-nums.txt'
 PREFERENCE_FILENAME = 'pechaprefs.csv'
 OUTPUT_FILENAME = 'output1.txt'
 
 # Parameters from problem statement
-# Strongly recommended NOT to change these.
-# Some parts of the algorithm rely specifically on these parameters (as well as the maximum preference group size of 2)
+# MAX_GROUP_SIZE can be GROUP_SIZE or GROUP_SIZE + 1 (e.g. groups of 3 to 5, see main_with_5.py);
+# the algorithm also relies on the maximum preference group size of 2
 NUM_OPTIONS = 9  # This INCLUDES the "non-specified" option
 GROUP_SIZE = 4
 MIN_GROUP_SIZE = 3
@@ -23,514 +51,2868 @@ ENABLE_NON_SPECIFIED = True  # Whether a specific option represents "non-specifi
 NON_SPECIFIED_CHOICE = 0  # The topic choice input that means "non-specified" (from actual input, not necessarily 0-indexed)
                           # If -1: the last option will be interpreted as "non-specified"
 NUM_TRIALS = 3  # Number of random trials executed
+                # If None: trials keep being run until TIME_LIMIT or PATIENCE stops them
+TIME_LIMIT = None  # If set, no more trials are started after this many seconds, and a trial still running by then is
+                   # abandoned; the best allocation so far is kept (as it is on Ctrl+C). If None: no time limit
+PATIENCE = None  # If set, no more trials are started after this many trials in a row without a better allocation
+GAP_TOLERANCE = 0  # If set, no more trials are started once the best allocation is within this much of an upper bound
+                   # on the optimum (0: once it is provably optimal, see upper_bound). If None: no bound is computed
+                   # (there is none for an odd GROUP_SIZE either)
+LOCAL_SEARCH = True  # If True, the allocation of each trial is improved by local search after the DP (see README)
+LOCAL_SEARCH_TIME_LIMIT = 1.0  # Maximum number of seconds spent on local search in each trial
+NUM_WORKERS = 1  # Number of processes that run trials in parallel (1: run all trials one after another in this process)
+SEED = None  # Base random seed; each trial is seeded from (SEED, trial number), so any trial can be reproduced exactly
+             # If None: a base seed is picked at random (and printed)
+SOLVER = 'dp'  # 'dp': DP on randomly shuffled preference groups, repeated for NUM_TRIALS trials (see README)
+              # 'classes': exact solver on classes of identical preference groups (needs an even GROUP_SIZE, see README)
+DP_ENGINE = 'dict'  # 'dict': sparse DP rows as dicts of reachable states
+                    # 'numpy': dense DP rows as NumPy arrays over all states (much faster, requires NumPy)
+                    # 'sparse': sparse DP rows as sorted NumPy arrays of reachable states (requires NumPy; for many
+                    # topics or MAX_GROUP_SIZE = 5, where dense rows get too large)
+RETIRE_TOPICS = True  # If True, a topic that no remaining preference group can be assigned to is dropped from the DP
+                      # states, merging states that only differ in it (same optimal value, fewer states; only used by
+                      # the 'dict' and 'sparse' engines without CHECKPOINT_FILENAME)
+GROUP_ORDER = 'random'  # 'random': preference groups are shuffled freely in each trial
+                        # 'stratified': groups are still shuffled, but clustered by their choices so that topics can be
+                        # retired early (see RETIRE_TOPICS and README); much faster with the 'dict' and 'sparse' engines
+PRUNE_STATES = False  # If True, DP states that provably cannot lead to the optimum are dropped after each row
+                      # (same optimal value, fewer states; only used by the 'dict' and 'sparse' engines)
+LOW_MEMORY = False  # If True, earlier DP value rows are freed as soon as the next row is built,
+                    # and decisions are stored as packed ints in compact arrays instead of dicts of tuples
+RECOMPUTE_TRACEBACK = False  # If True, the DP only keeps its value rows at every sqrt(n)-th preference group, and
+                             # traceback recomputes the decisions of each block of rows from them (about 2x the DP time
+                             # for about sqrt(n) times less memory, see README; not used with CHECKPOINT_FILENAME)
+CHECKPOINT_FILENAME = None  # If set, DP rows are saved to this file while they are computed, so that an interrupted
+                            # run can be continued with "python main.py resume" (see README); '%s' is replaced by
+                            # the trial's seed (then resume with "python main.py resume SEED"). If None: no checkpoints
+CHECKPOINT_EVERY = 10  # Number of preference groups between two writes to the checkpoint file
+PROGRESS_CALLBACK = None  # If set, function called after each DP row with a dict of stats of that row (see report_row)
+                          # If None: progress is printed instead, at most once every PROGRESS_INTERVAL seconds
+PROGRESS_INTERVAL = 1.0
+METRICS_FILENAME = None  # If set, phase timings and per-row DP stats of every trial are written to this JSON file
+                         # at the end of main(). If None: no metrics file
+PROFILE_TRIAL = None  # If set, this trial (1-indexed) runs under cProfile and tracemalloc; its profile is written to
+                      # PROFILE_FILENAME (see README), and its peak memory and top allocations are added to the metrics
+PROFILE_FILENAME = 'trial.prof'
+SERVE_PORT = 8342  # Port on localhost of the allocation server ("python main.py serve", see README)
+SERVE_JOBS = 2  # Number of solve jobs the server runs at the same time (their trials share NUM_WORKERS processes)
+SERVE_QUEUE_SIZE = 16  # Number of solve jobs that can wait for their turn; the server turns away any more
+SERVE_CACHE_SIZE = 8  # Number of parsed rosters the server keeps in memory (least recently used ones are dropped)
+SERVE_INPUT_DIR = '.'  # Directory that the server reads the roster files of jobs from (files outside it are refused)
+SERVE_OUTPUT_DIR = 'allocations'  # Directory that the server writes the output files of jobs to (created if needed;
+                                  # files outside it are refused)
+SERVE_MAX_STUDENTS = 1000  # Largest roster of a job (lines of its NetID file, and twice that for its preference file)
+SERVE_MAX_TOPICS = 12  # Largest number of topics of a job
+SERVE_MAX_GROUP_SIZE = 8  # Largest GROUP_SIZE of a job
+SERVE_MAX_STATES = 5 ** 8  # Largest number of DP states of a job (MAX_GROUP_SIZE ** topics; 5 ** 8 is main_with_5.py)
 
 
 # ----------- DO NOT MODIFY anything below ----------- #
 # (Unless you understand the algorithm well enough)
 
-NUM_TOPICS = NUM_OPTIONS - (1 if ENABLE_NON_SPECIFIED else 0)  # Actual number of topics, does not include "non-specified"
+# Parameters above that each Allocator owns, and can override with keyword arguments (in lowercase, see Allocator)
+PARAMETERS = ['NUM_OPTIONS', 'GROUP_SIZE', 'MIN_GROUP_SIZE', 'MAX_GROUP_SIZE', 'PREF_VALUES', 'IS_VALUE_PER_PERSON',
+              'ODD_SIZE_GROUP_PENALTY', 'ENABLE_NON_SPECIFIED', 'NON_SPECIFIED_CHOICE', 'TIME_LIMIT', 'PATIENCE', 'GAP_TOLERANCE',
+              'LOCAL_SEARCH', 'LOCAL_SEARCH_TIME_LIMIT', 'NUM_WORKERS', 'SOLVER', 'DP_ENGINE', 'RETIRE_TOPICS', 'GROUP_ORDER', 'PRUNE_STATES', 'LOW_MEMORY', 'RECOMPUTE_TRACEBACK', 'CHECKPOINT_FILENAME', 'CHECKPOINT_EVERY',
+              'PROGRESS_CALLBACK', 'PROGRESS_INTERVAL', 'METRICS_FILENAME', 'PROFILE_TRIAL', 'PROFILE_FILENAME']
+# Parameters above that a job posted to the server may set: those that define the problem and tune the solver, but
+# none that name files, run code, or take worker processes from other jobs
+SERVE_PARAMETERS = ['NUM_OPTIONS', 'GROUP_SIZE', 'MIN_GROUP_SIZE', 'MAX_GROUP_SIZE', 'PREF_VALUES', 'IS_VALUE_PER_PERSON',
+                    'ODD_SIZE_GROUP_PENALTY', 'ENABLE_NON_SPECIFIED', 'NON_SPECIFIED_CHOICE', 'TIME_LIMIT', 'PATIENCE',
+                    'GAP_TOLERANCE', 'LOCAL_SEARCH', 'LOCAL_SEARCH_TIME_LIMIT', 'SOLVER', 'DP_ENGINE', 'RETIRE_TOPICS',
+                    'GROUP_ORDER', 'PRUNE_STATES', 'LOW_MEMORY', 'RECOMPUTE_TRACEBACK']
+
+CHECKPOINT_MAGIC = b'CS342DP1'  # First bytes of every checkpoint file
+PRUNE_BEAM_WIDTH = 64  # Number of states kept per row by the heuristic that finds a threshold for PRUNE_STATES
+CLASS_MAX_STATES = 1000000  # Number of topic summaries that the classes solver may keep in total before it gives up
+                            # (ties in PREF_VALUES can make its rows grow exponentially, see solve_classes)
 
-# Instance variables
-netids = []  # List of all NetIDs
-netid_to_index = {}  # Dict mapping NetIDs to their index in netids list
-groups = []  # List of lists of student indexes (students without preferences are added at the end)
-prefs = []  # List of lists of topic indexes (students without preferences are listed as [-1])
+NEGATIVE_INFINITY = -1 * 10 ** 19
 
-f = []  # DP table (see README): each entry is a dict mapping a tuple of states (e.g. (0,1,0,2,0,2,1)) to value
-alloc = []  # Decision table: each entry is a dict mapping a tuple of states to the decision made at this step
-            # (i.e. Which topic was this person/group allocated to)
-            # Each decision is represented as a 3-tuple (old_state, topic, mode),
-            # mode=0 means add to existing group, mode=1 means new group
+worker_allocators = []  # Allocators of a worker process for parallel trials (see init_worker)
+shared_manager = None  # Manager process that relays events between solve_events and worker processes (see event_manager)
+shared_manager_lock = threading.Lock()
 
-NEGATIVE_INFINITY = -1 * 10 ** 19
+
+class TrialAbandoned(Exception):
+    """
+    Raised in a trial that is still running when TIME_LIMIT runs out (see report_row).
+    """
 
 
-def read_netids(filename):
+class SolveCancelled(Exception):
     """
-    Reads list of NetIDs from input file.
-    :param filename: Name of file
+    Raised in a trial that is still running when its solve is cancelled (see Allocator.cancel).
     """
-    global netids
-    global netid_to_index
-    with open(filename, 'r') as f:
-        lines = f.readlines()
-        netids = [s.strip() for s in lines if s.strip() != '']
-    netid_to_index = {netids[i]: i for i in range(len(netids))}
 
 
-def read_prefs(filename):
+class TooManyStates(Exception):
     """
-    Reads list of preferences from input file.
-    Also adds students who did not submit their preference as individual gorups.
-    (These students may be allocated to any topic or group)
-    :param filename: Name of file
+    Raised by the classes solver when its DP needs more than CLASS_MAX_STATES topic summaries (see solve_classes).
     """
-    def ppl_to_str(p):
-        return ', '.join([netids[x] for x in p])
-    def pref_to_str(p):
-        return ', '.join([(str(x+1) if x != -1 else 'non-specified') for x in p])
 
-    pref_submitted = {}  # Map person IDs to number of times appeared
-    with open(filename, 'r') as f:
-        for line in f.readlines():
-            if line.strip() == '':
-                continue
-            arr = line.split(',')
-            arr = [s.strip() for s in arr]
-
-            # Parse group and preferences
-            ppl = [netid_to_index[netid] for netid in arr[:-3] if netid in netid_to_index]  # Eliminate 9999 (no partner)
-            pref = [(int(s)-1) for s in arr[-3:]]
-            if ENABLE_NON_SPECIFIED:
-                pref = [(x if (x+1) != NON_SPECIFIED_CHOICE else -1) for x in pref]
-
-            # Check if group already exists
-            exist_index = -1
-            if ppl in groups:
-                exist_index = groups.index(ppl)
-            if ppl[::-1] in groups:  # Reverse order
-                exist_index = groups.index(ppl[::-1])
-            if exist_index != -1:
-                # Compare preferences for merging, by counting # of non-specified
-                exist_pref = prefs[exist_index]
-                if pref == exist_pref:  # Same preferences, no need to merge
-                    continue
 
-                pref_zeroes = sum(1 for x in pref if x == -1)
-                exist_pref_zeroes = sum(1 for x in exist_pref if x == -1)
-                merged_pref = exist_pref if exist_pref_zeroes <= pref_zeroes else pref
+class DenseDecisionRow:
+    """
+    Row of the decision table built by the NumPy DP engine: a flat array of packed decisions indexed by packed state.
+    Looking up a state gives the same (old_state, topic, mode) tuple as the dict rows, so traceback() works on both.
+    """
+    def __init__(self, allocator, decisions):
+        self.allocator = allocator
+        self.decisions = decisions
 
-                if pref_zeroes != len(pref) and exist_pref_zeroes != len(exist_pref):
-                    # Display warning message
-                    print('Warning: Pair %s has contradicting preferences submitted.' % ppl_to_str(groups[exist_index]))
-                    print('Preference submitted by pair %s: %s' % (ppl_to_str(groups[exist_index]), pref_to_str(exist_pref)))
-                    print('Preference submitted by pair %s: %s' % (ppl_to_str(ppl), pref_to_str(pref)))
-                    print('Program currently uses preference %s.' % pref_to_str(merged_pref))
-                    print()
+    def __getitem__(self, state):
+        return self.allocator.unpack_decision(state, int(self.decisions[state]))
 
-                prefs[exist_index] = merged_pref
-                continue
 
-            # Check if individuals already exist
-            if any(any(p in g for g in groups) for p in ppl):
-                keep_current = True  # Whether current group should be kept entirely
-                dups_all_members = set()  # Index of groups that contain any of the current group's members (discarded from list of groups later if keep_current)
-                members_to_discard = []  # Current group's members that are in other groups (discarded from current group later if not keep_current)
-                for p in ppl:
-                    dups = [i for i in range(len(groups)) if p in groups[i]]  # Indexes of groups that contain p
-                    if not dups:
-                        continue
-                    print('Warning: Person %s is in multiple groups: %s and Group %s.' % (
-                        netids[p],
-                        ', '.join(('Group ' + ppl_to_str(groups[i])) for i in dups),
-                        ppl_to_str(ppl)
-                    ))
-                    dups_same_len = [i for i in dups if len(groups[i]) >= len(ppl)]  # Index of groups above that have the same or greater size as current group
-                    if dups_same_len:
-                        # Full group that contains p already exists, disregard current group
-                        #print('Discarding Group %s with preference %s.' % (ppl_to_str(ppl), pref_to_str(pref)))
-                        keep_current = False
-                        members_to_discard.append(p)
-                    else:
-                        # p is only in groups with smaller sizes, these smaller groups will be discarded
-                        dups_all_members.update(dups)
-
-                if not keep_current:
-                    # First, try to remove members that are in other full groups
-                    # So that the current group can keep as many members as possible
-                    members_to_keep = [x for x in ppl if x not in members_to_discard]
-                    if members_to_keep:
-                        print('Discarding members %s from Group %s.' % (ppl_to_str(members_to_discard), ppl_to_str(ppl)))
-                        print('This group is left with members %s and preference %s.' % (ppl_to_str(members_to_keep), pref_to_str(pref)))
-                        ppl = members_to_keep
-                    else:
-                        # Discard current group completely
-                        print('Discarding Group %s with preference %s.' % (ppl_to_str(ppl), pref_to_str(pref)))
-                        print()
-                        continue
-                else:
-                    # Discard all groups in dups_all_members
-                    dups_all_members = list(dups_all_members)
-                    dups_all_members.sort()
-                    dups_all_members.reverse()  # Delete in reverse index order to preserve indexes
-                    for i in dups_all_members:
-                        print('Discarding Group %s with preference %s.' % (ppl_to_str(groups[i]), pref_to_str(prefs[i])))
-                        for p in groups[i]:  # Update pref_submitted
-                            x = pref_submitted.get(p, 0) - 1
-                            pref_submitted[p] = x
-                            if x <= 0:
-                                del pref_submitted[p]
-                        del groups[i]
-                        del prefs[i]
+class CompactDecisionRow:
+    """
+    Row of the decision table in LOW_MEMORY mode (or read from a checkpoint file): all reachable packed states
+    in sorted order, and a parallel array of packed decisions. Looking up a state gives the same
+    (old_state, topic, mode) tuple as the dict rows, with the old state rebuilt on the fly.
+    """
+    def __init__(self, allocator, states, decisions):
+        """
+        :param allocator: Allocator whose DP built this row
+        :param states: Sorted sequence of packed states (e.g. an array, or a memoryview of a checkpoint file)
+        :param decisions: Sequence of packed decisions (see pack_decision) of the same length
+        """
+        self.allocator = allocator
+        self.states = states
+        self.decisions = decisions
 
-                print()
+    def __getitem__(self, state):
+        index = bisect_left(self.states, state)
+        if index == len(self.states) or self.states[index] != state:
+            raise KeyError(state)
+        return self.allocator.unpack_decision(state, int(self.decisions[index]))
+
+
+class SparseRow:
+    """
+    Row of the sparse NumPy DP engine: all reachable packed states as a sorted NumPy array, and a parallel array of
+    entries (values in the DP table, or original states in retired_states). Looking up a state works like a dict.
+    """
+    def __init__(self, states, entries):
+        self.states = states
+        self.entries = entries
 
-            # Add new group
-            groups.append(ppl)
-            pref_submitted.update({p: pref_submitted.get(p, 0) + 1 for p in ppl})
-            prefs.append(pref)
+    def __len__(self):
+        return len(self.states)
 
-    # Adds students without preferences
-    for i in range(len(netids)):
-        if i not in pref_submitted:
-            groups.append([i])
-            prefs.append([-1])
+    def __getitem__(self, state):
+        index = int(np.searchsorted(self.states, state))
+        if index == len(self.states) or self.states[index] != state:
+            raise KeyError(state)
+        return int(self.entries[index])
 
 
-def shuffle_groups():
+@contextmanager
+def timed(phases, name):
     """
-    Shuffle list of preferences in random order.
+    Add the wall time of a block of code to phases[name] (in seconds).
     """
-    global groups, prefs
-    tuples = [(groups[i], prefs[i]) for i in range(len(groups))]
-    random.shuffle(tuples)
-    groups = [x for (x, y) in tuples]
-    prefs = [y for (x, y) in tuples]
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases[name] = phases.get(name, 0) + time.perf_counter() - start_time
 
 
-def dp():
+def read_checkpoint(filename):
     """
-    Computes the DP table. (See README for algorithm explanations)
+    Open a checkpoint file and locate all complete DP rows in it.
+    :return: - Header (see checkpoint_header)
+             - Memory map of the file
+             - List of complete rows, as 5-tuples (row index, states, values or None, decisions, end)
+               where states, values and decisions are memoryviews into the file,
+               and end is the offset in the file right after the row
+             - Offset in the file right after the header
     """
-    # Helper functions
-    def generate_states(old_state, topic, inc_amount=-1, fix_amount=-1):
+    with open(filename, 'rb') as file:
+        checkpoint_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    if checkpoint_map[:len(CHECKPOINT_MAGIC)] != CHECKPOINT_MAGIC:
+        raise ValueError('%s is not a checkpoint file.' % filename)
+    offset = len(CHECKPOINT_MAGIC)
+    header_length, = struct.unpack_from('<q', checkpoint_map, offset)
+    offset += 8
+    if offset + header_length > len(checkpoint_map):
+        raise ValueError('%s is incomplete (interrupted before its first row).' % filename)
+    header = json.loads(checkpoint_map[offset:offset+header_length].decode('utf-8'))
+    offset += header_length
+    header_end = offset
+
+    view = memoryview(checkpoint_map)
+    rows = []
+    while offset + 24 <= len(checkpoint_map):
+        row_index, num_states, has_values = struct.unpack_from('<qqq', checkpoint_map, offset)
+        states_start = offset + 24
+        decisions_start = states_start + 8 * num_states * (2 if has_values else 1)
+        end = decisions_start + 2 * num_states
+        end += -end % 8
+        if end > len(checkpoint_map):
+            break  # Incomplete row at the end
+        states = view[states_start:states_start+8*num_states].cast('q')
+        values = view[states_start+8*num_states:decisions_start].cast('q') if has_values else None
+        decisions = view[decisions_start:decisions_start+2*num_states].cast('h')
+        rows.append((row_index, states, values, decisions, end))
+        offset = end
+    return header, checkpoint_map, rows, header_end
+
+
+def trial_seed(base_seed, trial):
+    """
+    Derive the random seed of a single trial from the base seed.
+    """
+    return '%d-%d' % (base_seed, trial)
+
+
+class Allocator:
+    """
+    Group allocation of one cohort. Owns its roster, its parameters, its random number generator and its DP tables,
+    so several cohorts can be solved independently in one process (e.g. in threads).
+    Running main.py does the same as:
+
+        allocator = Allocator()
+        allocator.load(NETID_FILENAME, PREFERENCE_FILENAME)
+        allocator.solve(NUM_TRIALS, SEED)
+        allocator.write(OUTPUT_FILENAME)
+    """
+    def __init__(self, **params):
+        """
+        :param params: Parameters to override, named as in PARAMETERS but in lowercase (e.g. group_size=5);
+            all others are taken from the top of this file
+        """
+        for name in PARAMETERS:
+            setattr(self, name.lower(), params.pop(name.lower(), globals()[name]))
+        if params:
+            raise TypeError('Unknown parameters: %s' % ', '.join(sorted(params)))
+
+        if not 1 <= self.min_group_size <= self.group_size <= self.max_group_size <= self.group_size + 1:
+            raise ValueError("Group sizes need MIN_GROUP_SIZE <= GROUP_SIZE <= MAX_GROUP_SIZE <= GROUP_SIZE + 1.")
+        if self.solver == 'classes' and self.group_size % 2 != 0:
+            # Its topic summaries rely on pairs alone filling a group of GROUP_SIZE (see class_people_cap)
+            raise ValueError("SOLVER = 'classes' needs an even GROUP_SIZE.")
+        self.num_topics = self.num_options - (1 if self.enable_non_specified else 0)  # Actual number of topics, does not include "non-specified"
+        self.state_radix = self.max_group_size  # Leftover amounts are always in [0, MAX_GROUP_SIZE-1] (see next_amounts),
+                                                # so each one fits in a base-MAX_GROUP_SIZE digit
+        self.state_strides = [self.state_radix ** i for i in range(self.num_topics)]  # Value of one leftover person of each topic in a packed state
+        # Topic summaries of SOLVER = 'classes': numbers of people beyond class_people_cap only matter mod GROUP_SIZE,
+        # and numbers of singles beyond class_singles_cap do not matter at all
+        self.class_people_cap = 2 * self.group_size
+        self.class_singles_cap = self.max_group_size
+        self.build_tables()
+
+        # Instance variables
+        self.netids = []  # List of all NetIDs
+        self.netid_to_index = {}  # Dict mapping NetIDs to their index in netids list
+        self.groups = []  # List of lists of student indexes (students without preferences are added at the end)
+        self.prefs = []  # List of lists of topic indexes (students without preferences are listed as [-1])
+
+        self.f = []  # DP table (see README): each entry is a dict mapping a packed state (see encode_state) to value
+        self.alloc = []  # Decision table: each entry is a dict mapping a packed state to the decision made at this step
+                         # (i.e. Which topic was this person/group allocated to)
+                         # Each decision is represented as a 3-tuple (old_state, topic, mode),
+                         # mode=0 means add to existing group, mode=1 means new group
+        self.retired_states = {}  # For each row after which topics were retired (see dp), dict mapping each state of the row
+                                  # to the state it was merged from, which still has the leftovers of those topics
+        self.traceback_block = 0  # With RECOMPUTE_TRACEBACK: number of rows per block (see free_rows), 0 otherwise
+        self.num_candidates = 0  # Number of best incoming transitions kept for each state by dp (see top_allocations)
+        self.candidates = []  # If num_candidates > 0: for each row of the DP table, dict mapping a packed state to a list of
+                              # up to num_candidates 3-tuples (value through the transition, state before retirement, decision)
+        self.group_values = []  # For each preference group, list of values gained from assigning it to each topic
+                                # (NEGATIVE_INFINITY if not allowed), see precompute_group_values
+        self.group_topics = []  # For each preference group, list of topics it may be assigned to
+        self.split_cache = {}  # Memo of split_into_groups
+
+        self.random = random.Random()  # Random number generator of this allocator (seeded by each trial)
+        self.current_seed = None  # Random seed of the current trial (see run_trial)
+        self.deadline = None  # Time (as in time.time()) at which the current trial is abandoned (see TIME_LIMIT)
+        self.cancelled = False  # Whether the current solve was cancelled from another thread (see cancel)
+        self.cancel_event = None  # Managed event that also cancels trials in worker processes (see solve_events)
+        self.row_queue = None  # Managed queue that trials in worker processes send their row stats to (see solve_events)
+        self.checkpoint_file = None  # Open checkpoint file of the current DP (see start_checkpoint)
+        self.checkpoint_rows = 0  # Number of DP rows (after the initial row) already in checkpoint_file
+        self.trial_metrics = {'phases': {}, 'rows': []}  # Metrics of the current trial (see run_trial)
+        self.last_progress_time = 0  # When progress was last printed (see report_row)
+
+        self.value = NEGATIVE_INFINITY  # Best objective value found by solve()
+        self.bound = None  # Upper bound on the objective value of any allocation (see upper_bound), once computed
+        self.project_groups = []  # Best project group allocation found by solve() (see traceback)
+        self.metrics = {'phases': {}, 'trials': []}  # Metrics of load(), solve() and write() (see METRICS_FILENAME)
+
+    def encode_state(self, amounts):
         """
-        Get a list of possible new states by increasing the number of leftover people of a certain topic from an old state.
+        Packs a tuple of leftover amounts (e.g. (0,1,0,2,0,2,1)) into a single int, one base-STATE_RADIX digit per topic.
+        DP states are kept in this form so that transitions are plain integer arithmetic rather than new tuples.
+        :param amounts: Tuple of leftover amounts, one per topic
+        :return: Packed state
+        """
+        return sum(amounts[i] * self.state_strides[i] for i in range(self.num_topics))
+
+    def get_amount(self, state, topic):
+        """
+        Gets the leftover amount of a single topic from a packed state.
+        """
+        return state // self.state_strides[topic] % self.state_radix
+
+    def pack_decision(self, topic, mode, old_amount):
+        """
+        Packs a DP decision into a small int.
+        Storing the old leftover amount of the chosen topic is enough to recover the whole old state from the new state.
+        :param topic: Topic the current group is allocated to
+        :param mode: 0 if added to existing group, 1 if new group
+        :param old_amount: Leftover amount of this topic in the old state
+        :return: Packed decision
+        """
+        return (old_amount * self.num_topics + topic) * 2 + mode
+
+    def unpack_decision(self, state, decision):
+        """
+        Recovers a decision in the same format as entries of the alloc table.
+        :param state: New (packed) state the decision leads to
+        :param decision: Packed decision (see pack_decision)
+        :return: 3-tuple (old_state, topic, mode)
+        """
+        mode = decision % 2
+        topic = decision // 2 % self.num_topics
+        old_amount = decision // 2 // self.num_topics
+        old_state = state + (old_amount - self.get_amount(state, topic)) * self.state_strides[topic]
+        return old_state, topic, mode
+
+    def compact_alloc_row(self, alloc_row):
+        """
+        Convert a row of the decision table from a dict to a CompactDecisionRow.
+        :param alloc_row: Dict mapping packed states to (old_state, topic, mode)
+        """
+        states = array('q', sorted(alloc_row.keys()))
+        decisions = array('b' if self.pack_decision(self.num_topics - 1, 1, self.state_radix - 1) <= 127 else 'h')
+        for state in states:
+            old_state, topic, mode = alloc_row[state]
+            decisions.append(self.pack_decision(topic, mode, self.get_amount(old_state, topic)))
+        return CompactDecisionRow(self, states, decisions)
+
+    def next_amounts(self, old_amount, inc_amount=-1, fix_amount=-1):
+        """
+        Get the possible new leftover amounts of a topic after adding people to it.
+        Leftover amounts stay below MAX_GROUP_SIZE: people who fill a group up to MAX_GROUP_SIZE form it right away,
+        since a full group can take no one else (so groups of 4 and 3-4 or 3-5 people need only 4 or 5 amounts).
+        :param old_amount: Leftover amount of the topic in the old state
         :param inc_amount: Number of people to be added to the leftover people from the old state
             (If they exceed GROUP_SIZE, those GROUP_SIZE people form a group, and the leftover ones remain in the new state)
-        :param fix_amount: Number of people that are forced to start a new group;
-            leftover people from old state forms their own group (if between MIN_GROUP_SIZE and MAX_GROUP_SIZE)
-        :return: List of new states as tuple
-        """
-        new_amount = (fix_amount if fix_amount != -1 else old_state[topic] + inc_amount)
-        new_amounts = [new_amount % GROUP_SIZE]  # Forced to be in [0,3]
-        #if new_amount <= MAX_GROUP_SIZE:
-        #    new_amounts.append(new_amount)  # e.g. 5
-        #if new_amount > GROUP_SIZE:
-        #    new_amounts.append(new_amount % GROUP_SIZE)  # e.g. 1
-        return [tuple((old_state[i] if i != topic else amount)
-                      for i in range(len(old_state)))
-                for amount in new_amounts]
-
-    def calc_value(group, old_state, topic, inc_amount=-1, fix_amount=-1):
-        """
-        Calculate the objective value of a new state by transitioning from the given old state.
-        Does not check whether there's a valid new amount (that's done by generate_states).
-        :return: Value, or NEGATIVE_INFINITY if impossible
-        """
-        if inc_amount != -1 and fix_amount != -1:  # Shouldn't happen
-            return NEGATIVE_INFINITY
-        sum = f[group].get(old_state, NEGATIVE_INFINITY)
-        if sum == NEGATIVE_INFINITY:
+        :param fix_amount: Number of people that are forced to start a new group
+        :return: List of 2-tuples (new leftover amount, penalty of the group formed by the transition, if any)
+        """
+        new_amount = (fix_amount if fix_amount != -1 else old_amount + inc_amount)
+        transitions = []
+        if new_amount < self.max_group_size:
+            transitions.append((new_amount, 0))  # e.g. 3
+        elif new_amount == self.max_group_size:
+            transitions.append((0, self.leftover_penalty(new_amount)))  # Full group, e.g. 4 (or 5 with penalty)
+        if old_amount < self.group_size < new_amount and old_amount % 2 == 1 and inc_amount < self.group_size:
+            # GROUP_SIZE of them form a group, and the rest stay, e.g. 3+2 -> 1 (one single of the 3 makes way for the pair,
+            # see [Special Case 1] in traceback; an odd number of people always includes a single)
+            # (A full group of GROUP_SIZE followed by a new group, e.g. 4+1 -> 1, is the fix_amount transition instead;
+            # newcomers that fill a group of GROUP_SIZE on their own, e.g. a pair with GROUP_SIZE = 2, have no such swap)
+            transitions.append((new_amount - self.group_size, 0))
+        return transitions
+
+    def leftover_penalty(self, amount):
+        """
+        Calculate the penalty of a topic's leftover amount at the end of the DP (these people form their own group).
+        :return: Penalty, or NEGATIVE_INFINITY if they cannot form a valid group
+        """
+        if amount == 0 or amount == self.group_size:
+            return 0
+        elif self.min_group_size <= amount <= self.max_group_size:
+            return self.odd_size_group_penalty
+        else:
             return NEGATIVE_INFINITY
 
+    def build_tables(self):
+        """
+        Precomputes the lookup tables that the DP and find_maxima use instead of next_amounts and leftover_penalty,
+        once per parameter set (they only depend on leftover amounts):
+        - transitions[num_ppl][old_amount]: all transitions of a topic's leftover amount when a preference group of
+          num_ppl people joins it, as 3-tuples (mode, new_amount, penalty), mode=0 meaning add to the leftover people,
+          mode=1 meaning start a new group (the penalty includes that of the group the leftover people form)
+        - leftover_penalties[amount]: same as leftover_penalty(amount)
+        - final_penalties_low, final_penalties_high: total leftover penalty of the lower and upper digits of a packed state
+          (NEGATIVE_INFINITY if any of them cannot form a valid group), split at final_penalty_modulus, so the
+          final penalty of a whole state is final_penalties_low[state % modulus] + final_penalties_high[state // modulus]
+          (Two half tables instead of one over all states, which would be as large as a dense DP row)
+        """
+        self.transitions = [None]
+        for num_ppl in range(1, max(self.max_group_size, 2) + 1):  # Pairs need a table even if they fit in no group
+            table = []
+            for old_amount in range(self.state_radix):
+                # Approach 1: Add this group to leftover people on this topic from old state
+                amount_transitions = [(0, new_amount, penalty)
+                                      for new_amount, penalty in self.next_amounts(old_amount, inc_amount=num_ppl)]
+                # Approach 2: Make this group the start of a new project group, forcing all leftover people to form a complete group
+                # (only if the old leftover amount is between MIN_GROUP_SIZE and MAX_GROUP_SIZE, even not for 0)
+                if self.min_group_size <= old_amount <= self.max_group_size:
+                    penalty = self.odd_size_group_penalty if old_amount != self.group_size else 0
+                    amount_transitions += [(1, new_amount, penalty + new_penalty)
+                                           for new_amount, new_penalty in self.next_amounts(old_amount, fix_amount=num_ppl)]
+                table.append(tuple(amount_transitions))
+            self.transitions.append(table)
+
+        self.leftover_penalties = [self.leftover_penalty(amount) for amount in range(self.state_radix)]
+
+        def digit_penalties(num_digits):
+            table = [0]
+            for _ in range(num_digits):
+                table = [NEGATIVE_INFINITY if NEGATIVE_INFINITY in (total, penalty) else total + penalty
+                         for penalty in self.leftover_penalties for total in table]
+            return table
+        low_digits = self.num_topics // 2
+        self.final_penalty_modulus = self.state_radix ** low_digits
+        self.final_penalties_low = digit_penalties(low_digits)
+        self.final_penalties_high = digit_penalties(self.num_topics - low_digits)
+
+    def final_penalty(self, state):
+        """
+        Total penalty of the leftover amounts of a final (packed) state, which form their own groups (see build_tables).
+        :return: Penalty, or NEGATIVE_INFINITY if any of them cannot form a valid group
+        """
+        low = self.final_penalties_low[state % self.final_penalty_modulus]
+        high = self.final_penalties_high[state // self.final_penalty_modulus]
+        return NEGATIVE_INFINITY if NEGATIVE_INFINITY in (low, high) else low + high
+
+    def calc_assign_value(self, group, topic):
+        """
+        Calculate the objective value gained from assigning a preference group to a topic.
+        :return: Value, or NEGATIVE_INFINITY if the group cannot be assigned to this topic
+        """
         # Value per capita gained from assigning current group
         assign_val = NEGATIVE_INFINITY
-        if prefs[group] == [-1]:  # Group did not submit their preferences
+        if self.prefs[group] == [-1]:  # Group did not submit their preferences
             assign_val = 0
         else:
-            if -1 in prefs[group]:  # Non-specified included as one of their preferences
-                assign_val = PREF_VALUES[prefs[group].index(-1)]
-            if topic in prefs[group]:
-                assign_val = max(assign_val, PREF_VALUES[prefs[group].index(topic)])
+            if -1 in self.prefs[group]:  # Non-specified included as one of their preferences
+                assign_val = self.pref_values[self.prefs[group].index(-1)]
+            if topic in self.prefs[group]:
+                assign_val = max(assign_val, self.pref_values[self.prefs[group].index(topic)])
         if assign_val == NEGATIVE_INFINITY:  # Forces the group to only be assigned to one of their chosen topics
             return NEGATIVE_INFINITY
-        sum += assign_val * (len(groups[group]) if IS_VALUE_PER_PERSON else 1)
-
-        # In the case of using fix_amount (forcing the current group to start a new project group),
-        # verify the old leftover amount is between MIN_GROUP_SIZE and MAX_GROUP_SIZE,
-        # and apply odd size penalty
-        if fix_amount != -1:
-            old_amount = old_state[topic]
-            if MIN_GROUP_SIZE <= old_amount <= MAX_GROUP_SIZE:
-                sum += ODD_SIZE_GROUP_PENALTY if old_amount != GROUP_SIZE else 0
-            else:
-                return NEGATIVE_INFINITY  # Does not allow force starting even if old_amount=0
+        return assign_val * (len(self.groups[group]) if self.is_value_per_person else 1)
 
-        return sum
+    def read_netids(self, filename):
+        """
+        Reads list of NetIDs from input file.
+        :param filename: Name of file
+        """
+        with open(filename, 'r') as f:
+            lines = f.readlines()
+            self.netids = [s.strip() for s in lines if s.strip() != '']
+        self.netid_to_index = {self.netids[i]: i for i in range(len(self.netids))}
 
-    def update_values(new_row, new_alloc_row, new_states, new_value, decision_token):
+    def read_prefs(self, filename):
         """
-        Provide a possible objective value for a new state. Checks if that's better than its current value,
-        and update if it is.
-        :param row: Row as dict from f
+        Reads list of preferences from input file.
+        Also adds students who did not submit their preference as individual gorups.
+        (These students may be allocated to any topic or group)
+
+        Groups are looked up by their members and by each person through indexes, and discarded groups are only
+        marked as such (None) until the end, so reading takes linear time in the size of the file.
+        :param filename: Name of file
         """
-        if new_value <= NEGATIVE_INFINITY + 100:
-            return
-        # Update each new state to possibly improve its objective value
-        for new_state in new_states:
-            if new_row.get(new_state, NEGATIVE_INFINITY) < new_value:
-                new_row[new_state] = new_value
-                new_alloc_row[new_state] = decision_token
-
-    # Generate initial state
-    f.append({})
-    alloc.append({})
-    empty_state = (0,) * NUM_TOPICS
-    f[0][empty_state] = 0
-    alloc[0][empty_state] = (-1, -1)
-
-    # DP on each preference group (note that f is 1-indexed)
-    # i.e. f[i] + group[i] -> f[i+1]
-    for i in range(0, len(groups)):
-        print("Allocating group %d of %d..." % (i+1, len(groups)))
-
-        old_row = f[-1]
-        f.append({})
-        alloc.append({})
-        new_row = f[-1]
-        new_alloc_row = alloc[-1]
-
-        # Generate possible topics for group i, and shuffle in random order
-        topics = prefs[i] if -1 not in prefs[i] else list(range(NUM_TOPICS))  # All topics to consider
-        topics = list(topics)  # Clone
-        random.shuffle(topics)
-        num_ppl = len(groups[i])  # Number of people in this group
-
-        # Generate all states in old row, and shuffle in random order
-        old_states = list(old_row.keys())
-        random.shuffle(old_states)
-
-        # Based on each (calculated) feasible state in old_row, expand to new feasible states in new_row
-        for old_state in old_states:
-            for topic in topics:
-                # Approach 1: Add this group to leftover people on this topic from old state
-                new_states = generate_states(old_state, topic, inc_amount=num_ppl)
-                new_value = calc_value(i, old_state, topic, inc_amount=num_ppl)
-                #if new_value > NEGATIVE_INFINITY:
-                #    print(old_state, old_row[old_state], i, topic, new_value)
-                decision_token = (old_state, topic, 0)  # For alloc table
-                update_values(new_row, new_alloc_row, new_states, new_value, decision_token)
+        def ppl_to_str(p):
+            return ', '.join([self.netids[x] for x in p])
+        def pref_to_str(p):
+            return ', '.join([(str(x+1) if x != -1 else 'non-specified') for x in p])
+
+        messages = []  # Warnings, printed at once in the end (one write rather than one per line to the terminal)
+        log = messages.append
+        all_groups, all_prefs = [], []  # All groups added so far in order, None for groups discarded later
+        groups_by_key = {}  # Maps a group (as a tuple of person IDs) to indexes of groups in all_groups equal to it
+        groups_by_person = {}  # Maps a person ID to indexes of groups in all_groups that contain this person
+
+        def discard_group(index):
+            ppl = all_groups[index]
+            groups_by_key[tuple(ppl)].remove(index)
+            for p in set(ppl):
+                groups_by_person[p].remove(index)
+                if not groups_by_person[p]:
+                    del groups_by_person[p]
+            all_groups[index] = None
+            all_prefs[index] = None
+
+        netid_to_index = self.netid_to_index
+        non_specified = self.non_specified_choice - 1 if self.enable_non_specified else None
+        try:
+            with open(filename, 'r') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    arr = line.split(',')
+
+                    # Parse group and preferences (int() ignores the whitespace around choices, only NetIDs need stripping)
+                    ppl = []
+                    for netid in arr[:-3]:
+                        person = netid_to_index.get(netid.strip())
+                        if person is not None:  # Eliminate 9999 (no partner)
+                            ppl.append(person)
+                    pref = [int(s) - 1 for s in arr[-3:]]
+                    if non_specified in pref:
+                        pref = [(x if x != non_specified else -1) for x in pref]
+
+                    # Check if group already exists (in reverse order first, like before groups were indexed)
+                    key = tuple(ppl)
+                    same_groups = groups_by_key.get(key[::-1]) or groups_by_key.get(key)
+                    exist_index = same_groups[0] if same_groups else -1
+                    if exist_index != -1:
+                        # Compare preferences for merging, by counting # of non-specified
+                        exist_pref = all_prefs[exist_index]
+                        if pref == exist_pref:  # Same preferences, no need to merge
+                            continue
+
+                        pref_zeroes = sum(1 for x in pref if x == -1)
+                        exist_pref_zeroes = sum(1 for x in exist_pref if x == -1)
+                        merged_pref = exist_pref if exist_pref_zeroes <= pref_zeroes else pref
+
+                        if pref_zeroes != len(pref) and exist_pref_zeroes != len(exist_pref):
+                            # Display warning message
+                            log('Warning: Pair %s has contradicting preferences submitted.' % ppl_to_str(all_groups[exist_index]))
+                            log('Preference submitted by pair %s: %s' % (ppl_to_str(all_groups[exist_index]), pref_to_str(exist_pref)))
+                            log('Preference submitted by pair %s: %s' % (ppl_to_str(ppl), pref_to_str(pref)))
+                            log('Program currently uses preference %s.' % pref_to_str(merged_pref))
+                            log('')
+
+                        all_prefs[exist_index] = merged_pref
+                        continue
 
-                # Approach 2: Make this group the start of a new project group, forcing all leftover people to form a complete group
-                new_states = generate_states(old_state, topic, fix_amount=num_ppl)
-                new_value = calc_value(i, old_state, topic, fix_amount=num_ppl)
-                decision_token = (old_state, topic, 1)
-                update_values(new_row, new_alloc_row, new_states, new_value, decision_token)
+                    # Check if individuals already exist
+                    if not groups_by_person.keys().isdisjoint(ppl):
+                        keep_current = True  # Whether current group should be kept entirely
+                        dups_all_members = set()  # Index of groups that contain any of the current group's members (discarded from list of groups later if keep_current)
+                        members_to_discard = []  # Current group's members that are in other groups (discarded from current group later if not keep_current)
+                        for p in ppl:
+                            dups = list(groups_by_person.get(p, []))  # Indexes of groups that contain p
+                            if not dups:
+                                continue
+                            log('Warning: Person %s is in multiple groups: %s and Group %s.' % (
+                                self.netids[p],
+                                ', '.join(('Group ' + ppl_to_str(all_groups[i])) for i in dups),
+                                ppl_to_str(ppl)
+                            ))
+                            dups_same_len = [i for i in dups if len(all_groups[i]) >= len(ppl)]  # Index of groups above that have the same or greater size as current group
+                            if dups_same_len:
+                                # Full group that contains p already exists, disregard current group
+                                #log('Discarding Group %s with preference %s.' % (ppl_to_str(ppl), pref_to_str(pref)))
+                                keep_current = False
+                                members_to_discard.append(p)
+                            else:
+                                # p is only in groups with smaller sizes, these smaller groups will be discarded
+                                dups_all_members.update(dups)
+
+                        if not keep_current:
+                            # First, try to remove members that are in other full groups
+                            # So that the current group can keep as many members as possible
+                            members_to_keep = [x for x in ppl if x not in members_to_discard]
+                            if members_to_keep:
+                                log('Discarding members %s from Group %s.' % (ppl_to_str(members_to_discard), ppl_to_str(ppl)))
+                                log('This group is left with members %s and preference %s.' % (ppl_to_str(members_to_keep), pref_to_str(pref)))
+                                ppl = members_to_keep
+                            else:
+                                # Discard current group completely
+                                log('Discarding Group %s with preference %s.' % (ppl_to_str(ppl), pref_to_str(pref)))
+                                log('')
+                                continue
+                        else:
+                            # Discard all groups in dups_all_members
+                            for i in sorted(dups_all_members, reverse=True):  # Same order as before groups were indexed
+                                log('Discarding Group %s with preference %s.' % (ppl_to_str(all_groups[i]), pref_to_str(all_prefs[i])))
+                                discard_group(i)
+
+                        log('')
+
+                    # Add new group
+                    index = len(all_groups)
+                    all_groups.append(ppl)
+                    all_prefs.append(pref)
+                    groups_by_key.setdefault(tuple(ppl), []).append(index)
+                    for p in (ppl if len(ppl) == 1 else set(ppl)):
+                        groups_by_person.setdefault(p, []).append(index)
+        finally:
+            if messages:
+                print('\n'.join(messages))
+
+        self.groups.extend(ppl for ppl in all_groups if ppl is not None)
+        self.prefs.extend(pref for pref in all_prefs if pref is not None)
+
+        # Adds students without preferences
+        for i in range(len(self.netids)):
+            if i not in groups_by_person:
+                self.groups.append([i])
+                self.prefs.append([-1])
+
+    def shuffle_groups(self):
+        """
+        Shuffle list of preferences in random order.
+        With GROUP_ORDER = 'stratified', the topics are ranked from the least to the most chosen (ties in random order),
+        and each preference group goes into the stratum of its lowest ranked choice, next to groups with the same
+        choices. Once a stratum is done, no later group can be assigned to its topic, so the DP can retire it
+        (see RETIRE_TOPICS). Groups that can be assigned to any topic (no preferences, or "non-specified") go first,
+        since no topic can retire before the last of them. Groups are still in random order within each stratum.
+        :return: Shuffled order, as indexes into the lists before shuffling
+        """
+        order = list(range(len(self.groups)))
+        self.random.shuffle(order)
+        if self.group_order == 'stratified':
+            counts = [0] * self.num_topics  # Number of groups that chose each topic
+            for pref in self.prefs:
+                if -1 not in pref:
+                    for topic in set(pref):
+                        counts[topic] += 1
+            rank = [0] * self.num_topics
+            for i, topic in enumerate(sorted(range(self.num_topics), key=lambda t: (counts[t], self.random.random()))):
+                rank[topic] = i
+
+            def stratum(group):
+                if -1 in self.prefs[group]:
+                    return (-1,)
+                return tuple(sorted(rank[topic] for topic in set(self.prefs[group])))
+
+            order.sort(key=stratum)  # Stable, so groups stay shuffled within each stratum
+        self.groups = [self.groups[i] for i in order]
+        self.prefs = [self.prefs[i] for i in order]
+        return order
+
+    def precompute_group_values(self):
+        """
+        Precomputes the value of assigning each preference group to each topic, as well as the topics each group
+        may be assigned to, so that the DP only needs a list lookup per transition.
+        Must be called again whenever groups or prefs change (e.g. after shuffle_groups).
+        """
+        self.group_values = [[self.calc_assign_value(group, topic) for topic in range(self.num_topics)] for group in range(len(self.groups))]
+        self.group_topics = [list(pref) if -1 not in pref else list(range(self.num_topics)) for pref in self.prefs]
 
+    def calc_pruning_bounds(self):
+        """
+        Prepares the bounds used by PRUNE_STATES.
+        A state in row r can be dropped if its value, plus the best value all remaining groups can possibly add,
+        plus the penalties it will surely get, is still below a value that the DP is known to reach.
+        :return: - Incumbent: a final objective value the DP can reach (NEGATIVE_INFINITY if none found)
+                 - suffix_values: suffix_values[r] is the best value that groups r, r+1, ... can add
+                 - closed_topics: closed_topics[r] is the list of topics that none of groups r, r+1, ... can be assigned to
+                     (so leftovers of these topics are final)
+        """
+        suffix_values = [0] * (len(self.groups) + 1)
+        closed_topics = [list(range(self.num_topics))] * (len(self.groups) + 1)
+        open_topics = set()
+        for r in range(len(self.groups) - 1, -1, -1):
+            suffix_values[r] = suffix_values[r+1] + max(self.group_values[r])
+            open_topics.update(self.group_topics[r])
+            closed_topics[r] = [topic for topic in range(self.num_topics) if topic not in open_topics]
+
+        # Incumbent: run the DP keeping only the best few states of each row.
+        # Every state it reaches is also reachable in the full DP, so its final value is a lower bound of the optimum.
+        row = {self.encode_state((0,) * self.num_topics): 0}
+        for i in range(len(self.groups)):
+            new_row = {}
+            transitions = self.transitions[len(self.groups[i])]
+            for old_state, old_value in row.items():
+                for topic in self.group_topics[i]:
+                    value = old_value + self.group_values[i][topic]
+                    old_amount = self.get_amount(old_state, topic)
+                    for _, amount, penalty in transitions[old_amount]:
+                        new_state = old_state + (amount - old_amount) * self.state_strides[topic]
+                        if new_row.get(new_state, NEGATIVE_INFINITY) < value + penalty:
+                            new_row[new_state] = value + penalty
+            # Leftovers of closed topics are final, so drop states where they can never form a valid group
+            new_row = {state: value for state, value in new_row.items()
+                       if all(self.leftover_penalties[self.get_amount(state, topic)] != NEGATIVE_INFINITY
+                              for topic in closed_topics[i+1])}
+            row = dict(heapq.nlargest(PRUNE_BEAM_WIDTH, new_row.items(), key=lambda item: item[1]))
+
+        incumbent = NEGATIVE_INFINITY
+        for state, value in row.items():
+            penalty = self.final_penalty(state)
+            if penalty != NEGATIVE_INFINITY:
+                incumbent = max(incumbent, value + penalty)
+        return incumbent, suffix_values, closed_topics
+
+    def report_row(self, row, num_states, attempted, accepted, start, start_time):
+        """
+        Report the stats of a finished DP row to PROGRESS_CALLBACK (or print progress), and record them in the metrics
+        of the current trial if METRICS_FILENAME is set. Called once per row, so it costs next to nothing.
+        :param row: Index of the preference group that was just allocated (0-indexed)
+        :param num_states: Number of reachable states in the new row
+        :param attempted: Number of transitions from reachable old states that were tried
+        :param accepted: Number of them that improved the value of a new state (before pruning)
+        :param start: First row computed by this DP (see dp)
+        :param start_time: When this DP started
+        """
+        now = time.perf_counter()
+        elapsed = now - start_time
+        stats = {
+            'row': row + 1,
+            'num_rows': len(self.groups),
+            'states': num_states,
+            'transitions_attempted': attempted,
+            'transitions_accepted': accepted,
+            'elapsed': elapsed,
+            'remaining': elapsed / (row + 1 - start) * (len(self.groups) - row - 1),  # Assuming the rest take as long
+        }
+        if self.row_queue is not None:  # In a worker process, for solve_events in the main process
+            self.row_queue.put(stats)
+        elif self.progress_callback is not None:
+            self.progress_callback(stats)
+        elif now - self.last_progress_time >= self.progress_interval or row + 1 == len(self.groups):
+            print("Allocated group %d of %d (%d states, %.1fs elapsed, about %.0fs left)" % (
+                row + 1, len(self.groups), num_states, elapsed, stats['remaining']))
+            self.last_progress_time = now
+        if self.metrics_filename is not None:
+            self.trial_metrics['rows'].append(stats)
+        if self.deadline is not None and time.time() > self.deadline:
+            raise TrialAbandoned("Time limit reached after %d of %d groups." % (row + 1, len(self.groups)))
+        if self.cancelled or (self.cancel_event is not None and self.cancel_event.is_set()):
+            raise SolveCancelled("Cancelled after %d of %d groups." % (row + 1, len(self.groups)))
+
+    def dp(self, start=0, stop=None):
+        """
+        Computes the DP table. (See README for algorithm explanations)
+        :param start: Number of preference groups whose rows (f[0..start] and alloc[0..start]) are kept from the
+            previous DP on the same leading groups; only the rows after them are recomputed (see rerun)
+        :param stop: If set, only rows up to this one are computed, without reporting progress (see recompute_decisions)
+        """
+        num_candidates = self.num_candidates  # top_allocations needs the dict rows, all states and no checkpoints
+        if self.checkpoint_filename is not None and self.checkpoint_file is None and not num_candidates:
+            self.start_checkpoint(self.checkpoint_filename.replace('%s', str(self.current_seed)))
+        if stop is None:
+            use_blocks = self.recompute_traceback and self.checkpoint_filename is None and not num_candidates
+            self.traceback_block = math.isqrt(len(self.groups) - 1) + 1 if use_blocks and self.groups else 0
+
+        if self.dp_engine == 'numpy' and not num_candidates:
+            return self.dp_dense(start, stop)
+        if self.dp_engine == 'sparse' and not num_candidates:
+            return self.dp_sparse(start, stop)
+
+        # Looked up once here, since the loop below runs for every transition
+        state_strides, state_radix, group_values = self.state_strides, self.state_radix, self.group_values
+        leftover_penalties = self.leftover_penalties
+
+        # Helper functions
+        def add_candidate(new_state, new_value, decision_token):
+            """
+            Keep the best num_candidates transitions into each new state (as a min-heap) in new_candidate_row.
+            """
+            candidate = (new_value, new_state, decision_token)
+            candidates = new_candidate_row.setdefault(new_state, [])
+            if len(candidates) < num_candidates:
+                heapq.heappush(candidates, candidate)
+            elif candidates[0] < candidate:
+                heapq.heapreplace(candidates, candidate)
+
+        def retire(row_index, new_row, new_alloc_row, topics):
+            """
+            Finalize the leftovers of topics that no remaining group can be assigned to, with the same penalty as
+            find_maxima, and drop these topics from the states of a new row. States that only differ in them are merged,
+            keeping the best; the state each one was merged from is kept in retired_states for traceback.
+            :return: New row and decision row, with the merged states
+            """
+            merged_row, originals, merged_candidates = {}, {}, {}
+            for state, value in new_row.items():
+                merged_state, total_penalty = state, 0
+                for topic in topics:
+                    amount = state // state_strides[topic] % state_radix  # Same as get_amount
+                    penalty = leftover_penalties[amount]
+                    if penalty == NEGATIVE_INFINITY:
+                        break
+                    total_penalty += penalty
+                    merged_state -= amount * state_strides[topic]
+                else:
+                    if merged_row.get(merged_state, NEGATIVE_INFINITY) < value + total_penalty:
+                        merged_row[merged_state] = value + total_penalty
+                        originals[merged_state] = state
+                    if num_candidates:  # The transitions into all merged states compete for the merged state
+                        merged_candidates.setdefault(merged_state, []).extend(
+                            (candidate_value + total_penalty, original, decision)
+                            for candidate_value, original, decision in new_candidate_row[state])
+            self.retired_states[row_index] = originals
+            if num_candidates:
+                self.candidates[row_index] = {state: heapq.nlargest(num_candidates, candidates)
+                                              for state, candidates in merged_candidates.items()}
+            return merged_row, {state: new_alloc_row[state] for state in originals.values()}
+
+        def prune_row(row_index, new_row, new_alloc_row):
+            """
+            Drop states of a new row that cannot lead to the optimum (see calc_pruning_bounds).
+            """
+            for state in list(new_row.keys()):
+                bound = new_row[state] + suffix_values[row_index]
+                for topic in closed_topics[row_index]:
+                    bound += leftover_penalties[state // state_strides[topic] % state_radix]  # Same as get_amount
+                if bound < incumbent:
+                    del new_row[state]
+                    del new_alloc_row[state]
+
+        if self.prune_states and self.odd_size_group_penalty <= 0 and not num_candidates:  # Bounds assume that penalties never add to the objective
+            incumbent, suffix_values, closed_topics = self.calc_pruning_bounds()
+        else:
+            incumbent = NEGATIVE_INFINITY
+
+        # Topics to retire after each row: those that no later group can be assigned to
+        retire_after = [[] for _ in range(len(self.groups))]
+        if self.retire_topics and self.checkpoint_file is None:
+            last_groups = {}
+            for i in range(len(self.groups)):
+                for topic in self.group_topics[i]:
+                    last_groups[topic] = i
+            for topic, i in last_groups.items():
+                retire_after[i].append(topic)
+
+        if start > 0:
+            # Reuse rows from the previous DP
+            del self.f[start+1:]
+            del self.alloc[start+1:]
+            self.retired_states = {row: states for row, states in self.retired_states.items() if row <= start}
+        else:
+            self.retired_states = {}
+            # Generate initial state
+            self.f.append({})
+            self.alloc.append({})
+            empty_state = self.encode_state((0,) * self.num_topics)
+            self.f[0][empty_state] = 0
+            self.alloc[0][empty_state] = (-1, -1)
+            self.candidates = [{empty_state: []}] if num_candidates else []
+
+        # DP on each preference group (note that f is 1-indexed)
+        # i.e. f[i] + group[i] -> f[i+1]
+        start_time = time.perf_counter()
+        for i in range(start, len(self.groups) if stop is None else stop):
+            old_row = self.f[-1]
+            self.f.append({})
+            self.alloc.append({})
+            new_row = self.f[-1]
+            new_alloc_row = self.alloc[-1]
+            if num_candidates:
+                self.candidates.append({})
+                new_candidate_row = self.candidates[-1]
+
+            # Generate possible topics for group i (only their chosen ones, see precompute_group_values), and shuffle in random order
+            topics = list(self.group_topics[i])  # Clone
+            self.random.shuffle(topics)
+            num_ppl = len(self.groups[i])  # Number of people in this group
+            transitions = self.transitions[num_ppl]  # Transitions of each old leftover amount (see build_tables)
+
+            # Generate all states in old row, and shuffle in random order
+            old_states = list(old_row.keys())
+            self.random.shuffle(old_states)
+            attempted = accepted = 0
+
+            # Based on each (calculated) feasible state in old_row, expand to new feasible states in new_row
+            for old_state in old_states:
+                old_value = old_row[old_state]  # Same for all topics
+                for topic in topics:
+                    stride = state_strides[topic]
+                    old_amount = old_state // stride % state_radix  # Same as get_amount
+                    value = old_value + group_values[i][topic]
+                    attempted += len(transitions[old_amount])
+                    # Approach 1 (mode 0): Add this group to leftover people on this topic from old state
+                    # Approach 2 (mode 1): Make this group the start of a new project group, forcing all leftover people to form a complete group
+                    for mode, new_amount, penalty in transitions[old_amount]:
+                        new_state = old_state + (new_amount - old_amount) * stride
+                        new_value = value + penalty
+                        # Update the new state if this improves its objective value
+                        if new_row.get(new_state, NEGATIVE_INFINITY) < new_value:
+                            new_row[new_state] = new_value
+                            new_alloc_row[new_state] = (old_state, topic, mode)  # Decision for alloc table
+                            accepted += 1
+                        if num_candidates:
+                            add_candidate(new_state, new_value, (old_state, topic, mode))
+
+            if incumbent > NEGATIVE_INFINITY:
+                prune_row(i+1, new_row, new_alloc_row)
+            if retire_after[i]:
+                new_row, new_alloc_row = self.f[-1], self.alloc[-1] = retire(i+1, new_row, new_alloc_row, retire_after[i])
+            if stop is None:
+                self.report_row(i, len(new_row), attempted, accepted, start, start_time)
+
+            if self.low_memory:
+                if not self.traceback_block:
+                    self.f[-2] = None  # Never read again
+                self.alloc[-1] = self.compact_alloc_row(new_alloc_row)
+            if self.traceback_block:
+                self.free_rows(i+1)
+
+            if self.checkpoint_file is not None and ((i+1) % self.checkpoint_every == 0 or i+1 == len(self.groups)):
+                self.write_checkpoint(i+1)
+
+        if self.checkpoint_file is not None:
+            self.map_checkpoint()
+
+    def dp_dense(self, start=0, stop=None):
+        """
+        Computes the DP table with dense NumPy rows, as an alternative to the dict rows of dp().
+        Each row of f is an array of values over ALL packed states (NEGATIVE_INFINITY if unreachable),
+        and each row of alloc is a DenseDecisionRow of packed decisions.
+        Instead of expanding old states one by one, every (topic, old amount -> new amount) transition is applied
+        to all states at once by gathering from the old row.
+        Only the latest value row is kept; earlier rows are set to None since nothing reads them again.
+        :param start, stop: Same as dp()
+        """
+        if np is None:
+            raise ImportError("DP_ENGINE = 'numpy' requires NumPy to be installed.")
+
+        num_states = self.state_radix ** self.num_topics
+        all_states = np.arange(num_states, dtype=np.int64)
+        # states_by_amount[topic][amount]: All states with the given leftover amount of this topic
+        states_by_amount = [[np.flatnonzero(all_states // self.state_strides[topic] % self.state_radix == amount)
+                             for amount in range(self.state_radix)]
+                            for topic in range(self.num_topics)]
+        decision_type = np.int8 if self.pack_decision(self.num_topics - 1, 1, self.state_radix - 1) <= np.iinfo(np.int8).max else np.int16
+
+        if start > 0:
+            # Reuse rows from the previous DP (the last one may be a dict, e.g. from a checkpoint)
+            del self.f[start+1:]
+            del self.alloc[start+1:]
+            if isinstance(self.f[start], dict):
+                first_row = np.full(num_states, NEGATIVE_INFINITY, dtype=np.float64)
+                first_row[list(self.f[start].keys())] = list(self.f[start].values())
+                self.f[start] = first_row
+        else:
+            # Generate initial state
+            first_row = np.full(num_states, NEGATIVE_INFINITY, dtype=np.float64)
+            first_row[self.encode_state((0,) * self.num_topics)] = 0
+            self.f.append(first_row)
+            self.alloc.append({self.encode_state((0,) * self.num_topics): (-1, -1)})
+
+        start_time = time.perf_counter()
+        for i in range(start, len(self.groups) if stop is None else stop):
+            old_row = self.f[-1]
+            new_row = np.full(num_states, NEGATIVE_INFINITY, dtype=np.float64)
+            new_decisions = np.full(num_states, -1, dtype=decision_type)
+
+            # Generate possible topics for group i, and shuffle in random order
+            topics = list(self.group_topics[i])  # Clone
+            self.random.shuffle(topics)
+            transitions = [(old_amount, new_amount, mode, penalty)  # Of a single topic's leftover amount (see build_tables)
+                           for old_amount, amount_transitions in enumerate(self.transitions[len(self.groups[i])])
+                           for mode, new_amount, penalty in amount_transitions]
+            attempted = accepted = 0
 
-def find_maxima():
-    """
-    Find all final states in the DP table that gives the solution with the maximum objective value.
-    :return: - List of final states (empty if no feasible solutions)
-             - Final objective value
-    """
-    max_value = NEGATIVE_INFINITY
-    max_states = []
+            for topic in topics:
+                assign_val = self.group_values[i][topic]
+                if assign_val == NEGATIVE_INFINITY:
+                    continue
+                for old_amount, new_amount, mode, penalty in transitions:
+                    new_states = states_by_amount[topic][new_amount]
+                    old_values = old_row[new_states + (old_amount - new_amount) * self.state_strides[topic]]
+                    reachable = old_values > NEGATIVE_INFINITY + 100  # Only transitions from these are counted as attempted
+                    candidates = old_values + (assign_val + penalty)
+                    better = (candidates > new_row[new_states]) & reachable
+                    attempted += int(np.count_nonzero(reachable))
+                    new_states = new_states[better]
+                    accepted += len(new_states)
+                    new_row[new_states] = candidates[better]
+                    new_decisions[new_states] = self.pack_decision(topic, mode, old_amount)
+
+            unreachable = new_row <= NEGATIVE_INFINITY + 100
+            new_row[unreachable] = NEGATIVE_INFINITY
+            if stop is None:
+                self.report_row(i, num_states - int(np.count_nonzero(unreachable)), attempted, accepted, start, start_time)
+            if not self.traceback_block:
+                self.f[-1] = None  # Never read again
+            self.f.append(new_row)
+            self.alloc.append(DenseDecisionRow(self, new_decisions))
+            if self.traceback_block:
+                self.free_rows(i+1)
+
+            if self.checkpoint_file is not None and ((i+1) % self.checkpoint_every == 0 or i+1 == len(self.groups)):
+                self.write_checkpoint(i+1)
+
+        if self.checkpoint_file is not None:
+            self.map_checkpoint()
+
+    def dp_sparse(self, start=0, stop=None):
+        """
+        Computes the DP table with sparse NumPy rows, as an alternative to the dict rows of dp() when dense rows
+        (see dp_dense) would be too large. Each row of f is a SparseRow of the reachable states and their values,
+        and each row of alloc is a CompactDecisionRow over the same states, so memory is proportional to the number
+        of reachable states, without a Python object per state.
+        Each (topic, old amount -> new amount) transition is applied to all old states with that amount at once, and
+        the candidates of all transitions are merged by sorting them by state, keeping the best value of each.
+        Topics are retired and states pruned as in dp(). Only the latest value row is kept.
+        :param start, stop: Same as dp()
+        """
+        if np is None:
+            raise ImportError("DP_ENGINE = 'sparse' requires NumPy to be installed.")
+
+        state_strides = np.array(self.state_strides, dtype=np.int64)
+        leftover_penalties = np.array(self.leftover_penalties, dtype=np.float64)
+        decision_type = np.int8 if self.pack_decision(self.num_topics - 1, 1, self.state_radix - 1) <= np.iinfo(np.int8).max else np.int16
+
+        # Helper functions
+        def best_per_state(states, values, *columns):
+            """
+            Group candidates by state, keeping the one with the best value of each (the first one on ties).
+            :param columns: Arrays parallel to states, filtered like values
+            :return: Sorted unique states, their best values, and the filtered columns
+            """
+            # Candidates of each transition are sorted runs of states, which a stable sort merges quickly
+            order = np.argsort(states, kind='stable')
+            states, values = states[order], values[order]
+            first = np.empty(len(states), dtype=bool)  # Whether each candidate is the first of its state
+            first[:1] = True
+            np.not_equal(states[1:], states[:-1], out=first[1:])
+            starts = np.flatnonzero(first)
+            if len(starts) == 0:
+                return (states, values) + tuple(column[order] for column in columns)
+            best = np.repeat(np.maximum.reduceat(values, starts), np.diff(np.append(starts, len(states))))
+            kept = np.flatnonzero(values == best)
+            kept = kept[np.append(True, states[kept[1:]] != states[kept[:-1]])]  # First best candidate of each state
+            return (states[kept], values[kept]) + tuple(column[order[kept]] for column in columns)
+
+        def leftover_penalty_sum(states, topics):
+            """
+            Total penalty of the leftovers of some topics in each state, as in find_maxima (about NEGATIVE_INFINITY,
+            i.e. far below any value, if any of them cannot form a valid group).
+            """
+            total = np.zeros(len(states), dtype=np.float64)
+            for topic in topics:
+                total += leftover_penalties[states // state_strides[topic] % self.state_radix]
+            return total
+
+        if self.prune_states and self.odd_size_group_penalty <= 0:  # Bounds assume that penalties never add to the objective
+            incumbent, suffix_values, closed_topics = self.calc_pruning_bounds()
+        else:
+            incumbent = NEGATIVE_INFINITY
+
+        # Topics to retire after each row: those that no later group can be assigned to (see dp)
+        retire_after = [[] for _ in range(len(self.groups))]
+        if self.retire_topics and self.checkpoint_file is None:
+            last_groups = {}
+            for i in range(len(self.groups)):
+                for topic in self.group_topics[i]:
+                    last_groups[topic] = i
+            for topic, i in last_groups.items():
+                retire_after[i].append(topic)
+
+        if start > 0:
+            # Reuse rows from the previous DP (the last one may be a dict, e.g. from a checkpoint)
+            del self.f[start+1:]
+            del self.alloc[start+1:]
+            self.retired_states = {row: states for row, states in self.retired_states.items() if row <= start}
+            if isinstance(self.f[start], dict):
+                states = np.array(sorted(self.f[start].keys()), dtype=np.int64)
+                self.f[start] = SparseRow(states, np.array([self.f[start][state] for state in states.tolist()], dtype=np.int64))
+        else:
+            self.retired_states = {}
+            # Generate initial state
+            empty_state = self.encode_state((0,) * self.num_topics)
+            self.f.append(SparseRow(np.array([empty_state], dtype=np.int64), np.zeros(1, dtype=np.int64)))
+            self.alloc.append({empty_state: (-1, -1)})
+
+        start_time = time.perf_counter()
+        for i in range(start, len(self.groups) if stop is None else stop):
+            old_states, old_values = self.f[-1].states, self.f[-1].entries
+
+            # Generate possible topics for group i, and shuffle in random order
+            topics = list(self.group_topics[i])  # Clone
+            self.random.shuffle(topics)
+            transitions = self.transitions[len(self.groups[i])]  # Transitions of each old leftover amount (see build_tables)
+
+            # Candidates of all transitions, merged below (starting empty, in case the old row has no states)
+            candidate_states = [np.empty(0, dtype=np.int64)]
+            candidate_values = [np.empty(0, dtype=np.int64)]
+            candidate_decisions = [np.empty(0, dtype=decision_type)]
+            for topic in topics:
+                assign_val = self.group_values[i][topic]
+                if assign_val == NEGATIVE_INFINITY:
+                    continue
+                stride = self.state_strides[topic]
+                old_amounts = old_states // stride % self.state_radix
+                for old_amount in range(self.state_radix):
+                    with_amount = np.flatnonzero(old_amounts == old_amount)
+                    if len(with_amount) == 0:
+                        continue
+                    states, values = old_states[with_amount], old_values[with_amount]
+                    for mode, new_amount, penalty in transitions[old_amount]:
+                        candidate_states.append(states + (new_amount - old_amount) * stride)
+                        candidate_values.append(values + (assign_val + penalty))
+                        candidate_decisions.append(np.full(len(states), self.pack_decision(topic, mode, old_amount),
+                                                           dtype=decision_type))
+            new_states, new_values, new_decisions = best_per_state(np.concatenate(candidate_states),
+                                                                   np.concatenate(candidate_values),
+                                                                   np.concatenate(candidate_decisions))
+            attempted = sum(len(states) for states in candidate_states)
+            accepted = len(new_states)  # The best candidate of each new state, before pruning and retiring topics
+
+            if incumbent > NEGATIVE_INFINITY:
+                # Drop states that cannot lead to the optimum (see calc_pruning_bounds and prune_row in dp)
+                bounds = new_values + suffix_values[i+1] + leftover_penalty_sum(new_states, closed_topics[i+1])
+                kept = bounds >= incumbent
+                new_states, new_values, new_decisions = new_states[kept], new_values[kept], new_decisions[kept]
+            self.alloc.append(CompactDecisionRow(self, new_states, new_decisions))
+
+            if retire_after[i]:
+                # Finalize the leftovers of retired topics and merge states that only differ in them (see retire in dp)
+                penalties = leftover_penalty_sum(new_states, retire_after[i])
+                valid = penalties > NEGATIVE_INFINITY + 100
+                original_states = new_states[valid]
+                merged_states = original_states.copy()
+                for topic in retire_after[i]:
+                    merged_states -= original_states // state_strides[topic] % self.state_radix * state_strides[topic]
+                new_states, new_values, original_states = best_per_state(
+                    merged_states, new_values[valid] + penalties[valid].astype(np.int64), original_states)
+                self.retired_states[i+1] = SparseRow(new_states, original_states)
+
+            if stop is None:
+                self.report_row(i, len(new_states), attempted, accepted, start, start_time)
+            if not self.traceback_block:
+                self.f[-1] = None  # Never read again
+            self.f.append(SparseRow(new_states, new_values))
+            if self.traceback_block:
+                self.free_rows(i+1)
+
+            if self.checkpoint_file is not None and ((i+1) % self.checkpoint_every == 0 or i+1 == len(self.groups)):
+                self.write_checkpoint(i+1)
+
+        if self.checkpoint_file is not None:
+            self.map_checkpoint()
+
+    def free_rows(self, row):
+        """
+        With RECOMPUTE_TRACEBACK, free the rows of the DP table that traceback can recompute, once a row is built.
+        Rows are split into blocks of traceback_block rows, and only the value rows at the start of each block are kept,
+        with the last value row (for find_maxima) and the decision rows of the last block (where traceback starts).
+        :param row: Row that was just built (f[row] and alloc[row])
+        """
+        if (row - 1) % self.traceback_block != 0:
+            self.f[row-1] = None
+        if row % self.traceback_block == 0 and row < len(self.groups):  # End of a block before the last one
+            for block_row in range(row - self.traceback_block + 1, row + 1):
+                self.alloc[block_row] = None
 
-    def calc_final_value(state):
+    def recompute_decisions(self, row):
         """
-        Calculate the final objective value of a state, after possible odd size penalties for leftover groups.
-        :param state: Final state
-        :return: Final objective value, or NEGATIVE_INFINITY if state is invalid
+        Rebuild the decision rows of the block that contains a given row, by running the DP again from the value row
+        at the start of the block (see free_rows). Decision rows after the block, which traceback is done with, are freed.
+        Values are the same as in the first run, so the states traceback goes through are all reached again
+        (possibly with other decisions on ties).
+        :param row: Row of the decision table that traceback needs
         """
-        if state not in f[-1]:
-            return NEGATIVE_INFINITY
-        val = f[-1][state]
-        for i in range(NUM_TOPICS):
-            if state[i] == 0 or state[i] == GROUP_SIZE:
-                pass
-            elif MIN_GROUP_SIZE <= state[i] <= MAX_GROUP_SIZE:
-                val += ODD_SIZE_GROUP_PENALTY
+        if self.deadline is not None and time.time() > self.deadline:
+            raise TrialAbandoned("Time limit reached during traceback.")
+        block = self.traceback_block
+        start = (row - 1) // block * block
+        stop = min(start + block, len(self.groups))
+        for block_row in range(stop + 1, len(self.alloc)):
+            self.alloc[block_row] = None
+
+        f, alloc, retired_states = self.f, self.alloc, self.retired_states
+        # The DP below only appends to these copies (and starts them over from the initial state for the first block)
+        self.f, self.alloc = (f[:start+1], alloc[:start+1]) if start > 0 else ([], [])
+        self.traceback_block = 0  # Keep all rows of the block
+        try:
+            self.dp(start, stop)
+            alloc[start+1:stop+1] = self.alloc[start+1:stop+1]
+            retired_states.update(self.retired_states)
+        finally:
+            self.f, self.alloc, self.retired_states = f, alloc, retired_states
+            self.traceback_block = block
+
+    def checkpoint_header(self):
+        """
+        Get the header of a checkpoint file for the current run: everything needed to check that a checkpoint
+        belongs to the same problem, and to continue it.
+        """
+        return {
+            'byteorder': sys.byteorder,
+            'seed': self.current_seed,
+            'netids': self.netids,
+            'groups': self.groups,
+            'prefs': self.prefs,
+            'params': {
+                'NUM_TOPICS': self.num_topics,
+                'GROUP_SIZE': self.group_size,
+                'MIN_GROUP_SIZE': self.min_group_size,
+                'MAX_GROUP_SIZE': self.max_group_size,
+                'STATE_RADIX': self.state_radix,
+                'PREF_VALUES': self.pref_values,
+                'IS_VALUE_PER_PERSON': self.is_value_per_person,
+                'ODD_SIZE_GROUP_PENALTY': self.odd_size_group_penalty,
+            },
+        }
+
+    def start_checkpoint(self, filename):
+        """
+        Create a checkpoint file for the DP of the current run, and write its header.
+
+        Checkpoint file format (every section padded to a multiple of 8 bytes): the header length and the first 3 int64
+        of each record are little-endian ('<q'), while the arrays of states, values and decisions are in native byte order
+        (recorded in the header as 'byteorder'), so that they can be read back from the file via mmap without copying
+        - CHECKPOINT_MAGIC, then the length of the header and the header itself as JSON (see checkpoint_header)
+        - One record per DP row, in order: row index, number of states and whether values are included (3 int64),
+          then the sorted packed states (int64), their values (int64, only for the last row of each write),
+          and their packed decisions (int16, see pack_decision)
+        Records are only ever appended, so an interrupted write leaves at most one incomplete record at the end.
+        """
+        header = json.dumps(self.checkpoint_header()).encode('utf-8')
+        header += b' ' * (-len(header) % 8)
+        self.checkpoint_file = open(filename, 'wb')
+        self.checkpoint_file.write(CHECKPOINT_MAGIC + struct.pack('<q', len(header)) + header)
+        self.checkpoint_file.flush()
+        self.checkpoint_rows = 0
+
+    def write_checkpoint(self, last_row):
+        """
+        Append all DP rows that are not in the checkpoint file yet, up to last_row.
+        The decisions of written rows are then dropped from memory; map_checkpoint() reads them back when needed.
+        """
+        for row_index in range(self.checkpoint_rows + 1, last_row + 1):
+            alloc_row = self.alloc[row_index]
+            if isinstance(alloc_row, DenseDecisionRow):
+                reachable = np.flatnonzero(alloc_row.decisions >= 0)
+                states = array('q', reachable.tolist())
+                decisions = array('h', alloc_row.decisions[reachable].tolist())
+            elif isinstance(alloc_row, CompactDecisionRow):
+                states, decisions = array('q', alloc_row.states), array('h', alloc_row.decisions)
             else:
-                return NEGATIVE_INFINITY
-        return val
-
-    for state in f[-1].keys():
-        val = calc_final_value(state)
-        if val <= NEGATIVE_INFINITY:
-            continue
-        #print(state, val, f[-1][state])
-        if val > max_value:
-            max_value = val
-            max_states = [state]
-        elif val == max_value:
-            max_states.append(state)
-
-    return max_states, max_value
-
-
-def traceback(state):
-    """
-    Given an entry of the DP table, reconstruct the allocation of project groups.
-    :param group: Group index
-    :param state: Current state
-    :return: List of tuples containing each project group's members (using preference group IDs) and topic, as follows:
-        [([29, 41, 59], 3), ([1, 35], 5), ([27, 3], 2), ...]
-    """
-    project_groups = []  # Final output
-    leftovers = [[] for _ in range(NUM_TOPICS)]  # Each topic's leftover preference groups
-
-    # [Special Case 1]
-    # During DP, we intentially allow an old leftover of 3 to roll into 3->1 or 3->5.
-    # This is because if that happens, among the 3 leftover people, 1 of them must be from a single-person preference group,
-    # So we can swap it and the current group, forming a group of 4 (including current group),
-    # and 1 leftover which is that single-person preference group.
-    # The following variables deals with this.
-    three_to_one_marker = [False] * NUM_TOPICS
-    three_to_one_leftovers = [[] for _ in range(NUM_TOPICS)]
-
-    # [Special Case 2]
-    # Since we allow leftover to go up to 5, it's possible to go from 5->2 or 5->3 by inc.
-    # The following variables deal with this.
-    five_to_twothree_marker = [False] * NUM_TOPICS
-
-    def form_group(topic, leftover_source=leftovers):
-        if len(leftover_source[topic]) == 0:
-            return
-        project_groups.append((leftover_source[topic], topic))
-        leftover_source[topic] = []
-
-    for group in range(len(groups)-1, -1, -1):  # 0-indexed
-        #old_row = f[group]
-        #new_row = f[group+1]
-        new_alloc_row = alloc[group+1]
-        old_state, topic, approach = new_alloc_row[state]
-        #print(group, state, old_state, topic, approach, f[group][old_state], f[group+1][state])
-
-        # Push current group to appropriate leftover stack
-        if three_to_one_marker[topic] and len(groups[group]) == 1:
-            # [Special Case 1]: Single found, complete single+B stack (see below)
-            three_to_one_leftovers[topic].append(group)
-            form_group(topic, leftover_source=three_to_one_leftovers)
-            three_to_one_marker[topic] = False
+                compact_row = self.compact_alloc_row(alloc_row)
+                states, decisions = compact_row.states, array('h', compact_row.decisions)
+            has_values = row_index == last_row
+            record = struct.pack('<qqq', row_index, len(states), has_values) + states.tobytes()
+            if has_values:
+                value_row = self.f[row_index]
+                if isinstance(value_row, SparseRow):  # Same states as its decision row
+                    record += array('q', value_row.entries.tolist()).tobytes()
+                else:
+                    record += array('q', (int(value_row[state]) for state in states)).tobytes()
+            record += decisions.tobytes()
+            self.checkpoint_file.write(record + b'\0' * (-len(record) % 8))
+            self.alloc[row_index] = None
+        self.checkpoint_file.flush()
+        self.checkpoint_rows = last_row
+
+    def map_checkpoint(self):
+        """
+        Close the checkpoint file of the current run, and point all rows of the decision table to it via mmap,
+        so that traceback() reads decisions from the file instead of holding them in memory.
+        """
+        filename = self.checkpoint_file.name
+        self.checkpoint_file.close()
+        self.checkpoint_file = None
+        _, _, rows, _ = read_checkpoint(filename)
+        for row_index, states, _, decisions, _ in rows:
+            self.alloc[row_index] = CompactDecisionRow(self, states, decisions)
+
+    def resume(self, filename):
+        """
+        Continue the DP of an interrupted run from its checkpoint file, and reconstruct its allocation.
+        The checkpoint must have been created with the same parameters and NetIDs.
+        Afterwards, groups and prefs are in the (shuffled) order stored in the checkpoint.
+        :param filename: Name of checkpoint file
+        :return: - Objective value from this run
+                 - Project group allocation from this run
+        """
+        header, _, rows, header_end = read_checkpoint(filename)
+        expected = self.checkpoint_header()
+        for key in ['byteorder', 'netids', 'params']:
+            if header[key] != expected[key]:
+                raise ValueError('Checkpoint %s was created with different %s.' % (filename, key))
+        while rows and rows[-1][2] is None:
+            rows.pop()  # Can only continue from a row with values
+        self.groups, self.prefs = header['groups'], header['prefs']
+        self.current_seed = header['seed']
+
+        start = rows[-1][0] if rows else 0
+        print("Resuming from checkpoint after group %d of %d." % (start, len(self.groups)))
+        if rows:
+            self.f = [None] * start + [dict(zip(rows[-1][1], rows[-1][2]))]
+            self.alloc = [{self.encode_state((0,) * self.num_topics): (-1, -1)}]
+            for row_index, states, values, decisions, end in rows:
+                self.alloc.append(CompactDecisionRow(self, states, decisions))
         else:
-            leftovers[topic].append(group)  # NOTE: For repeated 3->1 (see below), this will make leftovers[topic] have a size of 6
+            self.f, self.alloc = [], []
+
+        # Continue appending right after the last row that is kept
+        self.checkpoint_file = open(filename, 'r+b')
+        self.checkpoint_file.truncate(rows[-1][4] if rows else header_end)
+        self.checkpoint_file.seek(0, 2)
+        self.checkpoint_rows = start
+
+        self.random.seed('%s-resume-%d' % (self.current_seed, start))
+        self.precompute_group_values()
+        self.dp(start)
+
+        max_states, max_value = self.find_maxima()
+        if not max_states:
+            return NEGATIVE_INFINITY, []
+        max_state = self.random.choice(max_states)
+        project_groups = self.traceback(max_state)
+        if self.local_search:
+            gain, project_groups = self.improve(project_groups)
+            max_value += gain
+        return max_value, project_groups
+
+    def find_maxima(self):
+        """
+        Find all final states in the DP table that gives the solution with the maximum objective value.
+        :return: - List of final (packed) states (empty if no feasible solutions)
+                 - Final objective value
+        """
+        final_row = self.f[-1]
+        if not isinstance(final_row, dict):  # Rows from dp_dense() or dp_sparse(), vectorized over all their states
+            if isinstance(final_row, SparseRow):
+                states, values = final_row.states, final_row.entries
+            else:  # Dense row
+                states, values = np.arange(len(final_row)), final_row
+            low = np.array(self.final_penalties_low, dtype=np.float64)[states % self.final_penalty_modulus]
+            high = np.array(self.final_penalties_high, dtype=np.float64)[states // self.final_penalty_modulus]
+            valid = (values > NEGATIVE_INFINITY) & (low > NEGATIVE_INFINITY) & (high > NEGATIVE_INFINITY)
+            if not valid.any():
+                return [], NEGATIVE_INFINITY
+            final_values = np.where(valid, values + low + high, -np.inf)
+            max_value = final_values.max()
+            return [int(state) for state in states[final_values == max_value]], int(max_value)
+
+        max_value = NEGATIVE_INFINITY
+        max_states = []
+        for state, val in final_row.items():
+            # Leftover people of each topic form their own groups, with possible odd size penalties
+            penalty = self.final_penalty(state)
+            if penalty == NEGATIVE_INFINITY:
+                continue
+            val += penalty
+            if val > max_value:
+                max_value = val
+                max_states = [state]
+            elif val == max_value:
+                max_states.append(state)
 
-        if approach == 0:
-            if old_state[topic] == 0:
-                form_group(topic)
-            elif old_state[topic] == GROUP_SIZE:  # 4->x
-                if state[topic] < old_state[topic]:  # 4->1, 4->2: form new group
-                    form_group(topic)
-                elif five_to_twothree_marker[topic]:  # 4->5, need to form group manually if current 5 came from an inc 5->2 or 5->3
-                    form_group(topic)
-                    five_to_twothree_marker[topic] = False
-                    # Note that if 5->23 marker is not active (which means 5 is followed by forced new group), no need to form here
-
-            elif old_state[topic] < GROUP_SIZE and (  # 3->x
-                    0 < state[topic] < old_state[topic]  # 3->1
-                    or state[topic] > GROUP_SIZE and five_to_twothree_marker[topic]):  # 3->5 (only if 5->23 marker is active, similar to above)
-                # *** [Special Case 1] ***
-                # Essentially: Assuming 0 -(A)(single)-> 3 -(curr)-> 1 -(B)-> 0, currently leftovers[topic] contains curr and B;
-                # We push B into three_to_one_leftovers[topic], which has the single from A as well as all of B (group of 4),
-                # and use leftovers[topic] for curr and the rest of A (another group of 4).
-                # Later when a single is found, instead of pushing it to leftovers, add it to three_to_one_leftovers and form group immediately.
-
-                # There's one single exception, the "special case of special case":
-                # Repeated 3->1's or 3->5's (e.g. 1a->2a->2b->2c->2d->2e->1b).
-                # In this case, when we get here with the new group being 2b, 3->1 marker is True,
-                # three_to_one_leftovers[topic] = [1b, 2e], and leftovers[topic] = [2d, 2c, 2b].
-                # If this happens, we make [2d, 2c] form a new group, and then leave 2b in leftovers[topic].
-                # Then we leave the 3->1 marker True, and keep doing this until a single-person group is found.
-
-                if three_to_one_marker[topic]:  # Repeated 3->1 or 3->5
-                    del leftovers[topic][-1]  # Remove 2b from [2d, 2c, 2b]
+        return max_states, max_value
+
+    def traceback(self, state, decisions=None):
+        """
+        Given an entry of the DP table, reconstruct the allocation of project groups.
+        :param state: Final (packed) state
+        :param decisions: If set, list of the decision made for each preference group, as 2-tuples
+            (new state before retirement, (old_state, topic, mode)), used instead of alloc (see top_allocations)
+        :return: List of tuples containing each project group's members (using preference group IDs) and topic, as follows:
+            [([29, 41, 59], 3), ([1, 35], 5), ([27, 3], 2), ...]
+        """
+        project_groups = []  # Final output
+        leftovers = [[] for _ in range(self.num_topics)]  # Each topic's leftover preference groups
+
+        # [Special Case 1]
+        # During DP, we intentially allow an odd old leftover below GROUP_SIZE to roll over GROUP_SIZE (e.g. 3->1).
+        # This is because if that happens, among the 3 leftover people, 1 of them must be from a single-person preference group,
+        # So we can swap it and the current group, forming a group of 4 (including current group),
+        # and 1 leftover which is that single-person preference group.
+        # The following variables deals with this.
+        three_to_one_marker = [False] * self.num_topics
+        three_to_one_leftovers = [[] for _ in range(self.num_topics)]
+
+        def form_group(topic, leftover_source=leftovers):
+            if len(leftover_source[topic]) == 0:
+                return
+            project_groups.append((leftover_source[topic], topic))
+            leftover_source[topic] = []
+
+        for group in range(len(self.groups)-1, -1, -1):  # 0-indexed
+            #old_row = f[group]
+            #new_row = f[group+1]
+            if decisions is not None:
+                state, (old_state, topic, approach) = decisions[group]
+            else:
+                if self.alloc[group+1] is None:  # Freed by RECOMPUTE_TRACEBACK
+                    self.recompute_decisions(group+1)
+                new_alloc_row = self.alloc[group+1]
+                if group+1 in self.retired_states:  # Some topics were retired after this row, restore their leftovers
+                    state = self.retired_states[group+1][state]
+                old_state, topic, approach = new_alloc_row[state]
+            amount, old_amount = self.get_amount(state, topic), self.get_amount(old_state, topic)  # Leftover amounts of this topic
+            #print(group, state, old_state, topic, approach, f[group][old_state], f[group+1][state])
+
+            # Push current group to appropriate leftover stack
+            if three_to_one_marker[topic] and len(self.groups[group]) == 1:
+                # [Special Case 1]: Single found, complete single+B stack (see below)
+                three_to_one_leftovers[topic].append(group)
+                form_group(topic, leftover_source=three_to_one_leftovers)
+                three_to_one_marker[topic] = False
+            else:
+                leftovers[topic].append(group)  # NOTE: For repeated 3->1 (see below), this will make leftovers[topic] have a size of 6
+
+            if approach == 0:
+                if old_amount == 0:
                     form_group(topic)
-                    leftovers[topic].append(group)  # Add back 2b
-                else:  # "Regular" 3->1 or 3->5: Start of marker
-                    three_to_one_marker[topic] = True
-                    three_to_one_leftovers[topic] = leftovers[topic][:-1]  # Contains B
-                    leftovers[topic] = [group]  # curr
+                elif old_amount < self.group_size and 0 < amount < old_amount:  # 3->1
+                    # *** [Special Case 1] ***
+                    # Essentially: Assuming 0 -(A)(single)-> 3 -(curr)-> 1 -(B)-> 0, currently leftovers[topic] contains curr and B;
+                    # We push B into three_to_one_leftovers[topic], which has the single from A as well as all of B (group of 4),
+                    # and use leftovers[topic] for curr and the rest of A (another group of 4).
+                    # Later when a single is found, instead of pushing it to leftovers, add it to three_to_one_leftovers and form group immediately.
+
+                    # There's one single exception, the "special case of special case":
+                    # Repeated 3->1's (e.g. 1a->2a->2b->2c->2d->2e->1b).
+                    # In this case, when we get here with the new group being 2b, 3->1 marker is True,
+                    # three_to_one_leftovers[topic] = [1b, 2e], and leftovers[topic] = [2d, 2c, 2b].
+                    # If this happens, we make [2d, 2c] form a new group, and then leave 2b in leftovers[topic].
+                    # Then we leave the 3->1 marker True, and keep doing this until a single-person group is found.
+
+                    if three_to_one_marker[topic]:  # Repeated 3->1
+                        del leftovers[topic][-1]  # Remove 2b from [2d, 2c, 2b]
+                        form_group(topic)
+                        leftovers[topic].append(group)  # Add back 2b
+                    else:  # "Regular" 3->1: Start of marker
+                        three_to_one_marker[topic] = True
+                        three_to_one_leftovers[topic] = leftovers[topic][:-1]  # Contains B
+                        leftovers[topic] = [group]  # curr
+
+            else:  # approach==1
+                form_group(topic)
 
-                if state[topic] > GROUP_SIZE and five_to_twothree_marker[topic]:  # Clear 5->23 marker if applicable
-                    five_to_twothree_marker[topic] = False
+            state = old_state
 
-            # [Special Case 2]
-            elif old_state[topic] > GROUP_SIZE and state[topic] < old_state[topic]:  # 5->2, 5->3
-                five_to_twothree_marker[topic] = True
+            #print(project_groups)
+            #print(leftovers)
 
-        else:  # approach==1
+        # Sanity check: Form all leftovers as groups
+        # Should not need this, but just in case
+        for topic in range(self.num_topics):
             form_group(topic)
 
-        state = old_state
+        return project_groups
+
+    def improve(self, project_groups):
+        """
+        Improve an allocation by local search. The DP can only put preference groups that are close to each other
+        in the shuffled order into the same project group, which leaves easy improvements that these moves find:
+        - Relocate a preference group to another project group (of the same or another topic)
+        - Swap two preference groups of different project groups
+        - Move a whole project group to another topic
+        - Merge two project groups, or split one in two (where MIN_GROUP_SIZE and MAX_GROUP_SIZE allow it)
+        The value of each project group for every topic is kept up to date, so the change in objective value of a move
+        takes a few lookups. Improving moves are made until there are none left, or LOCAL_SEARCH_TIME_LIMIT runs out.
+        :param project_groups: Project group allocation (see traceback)
+        :return: - Gain in objective value (also recorded in the metrics of the current trial)
+                 - Improved project group allocation (same format as traceback)
+        """
+        values = self.group_values
+        sizes = [len(group) for group in self.groups]
+        penalty = [self.leftover_penalty(people) for people in range(self.max_group_size + 1)]  # Of a project group
+        members = [list(group_members) for group_members, _ in project_groups]
+        topics = [topic for _, topic in project_groups]
+        people = [sum(sizes[g] for g in group_members) for group_members in members]
+        topic_values = [[sum(values[g][t] for g in group_members) for t in range(self.num_topics)]
+                        for group_members in members]  # topic_values[p][t]: value of project group p if its topic were t
+        end_time = time.time() + self.local_search_time_limit
+        if self.deadline is not None:
+            end_time = min(end_time, self.deadline)
+
+        def fits(num_ppl):
+            return num_ppl <= self.max_group_size and penalty[num_ppl] > NEGATIVE_INFINITY  # 0 fits (empty group)
+
+        def move(g, p, q):
+            members[p].remove(g)
+            members[q].append(g)
+            people[p] -= sizes[g]
+            people[q] += sizes[g]
+            for t in range(self.num_topics):
+                topic_values[p][t] -= values[g][t]
+                topic_values[q][t] += values[g][t]
+
+        def best_topic(group_values):
+            return max(range(self.num_topics), key=lambda t: group_values[t])
+
+        gain = 0
+        improved = True
+        while improved and time.time() < end_time:
+            improved = False
+            for p in range(len(members)):  # Project groups emptied by a move stay in the lists (with 0 people) until the end
+                if not members[p]:
+                    continue
+
+                # Topic of the whole project group
+                t = best_topic(topic_values[p])
+                if topic_values[p][t] > topic_values[p][topics[p]]:
+                    gain += topic_values[p][t] - topic_values[p][topics[p]]
+                    topics[p] = t
+                    improved = True
+
+                # Relocations and swaps of each of its preference groups
+                for g in list(members[p]):
+                    tp, sp, g_values = topics[p], people[p], values[g]
+                    leave_delta = penalty[sp - sizes[g]] - penalty[sp] - g_values[tp] if fits(sp - sizes[g]) else None
+                    for q in range(len(members)):
+                        if q == p or not members[q] or g_values[topics[q]] == NEGATIVE_INFINITY:
+                            continue
+                        tq, sq = topics[q], people[q]
+                        if leave_delta is not None and fits(sq + sizes[g]):
+                            delta = leave_delta + g_values[tq] + penalty[sq + sizes[g]] - penalty[sq]
+                            if delta > 0:
+                                move(g, p, q)
+                                break
+                        for h in members[q]:
+                            if (tp == tq and sizes[g] == sizes[h]) or values[h][tp] == NEGATIVE_INFINITY:
+                                continue
+                            new_sp, new_sq = sp - sizes[g] + sizes[h], sq - sizes[h] + sizes[g]
+                            if fits(new_sp) and fits(new_sq):
+                                delta = (g_values[tq] + values[h][tp] - g_values[tp] - values[h][tq]
+                                         + penalty[new_sp] - penalty[sp] + penalty[new_sq] - penalty[sq])
+                                if delta > 0:
+                                    move(g, p, q)
+                                    move(h, q, p)
+                                    break
+                        else:
+                            continue
+                        break  # Swapped
+                    else:
+                        continue
+                    gain += delta
+                    improved = True
 
+                # Merges with other project groups
+                for q in range(p + 1, len(members)):
+                    if not members[q] or not members[p] or not fits(people[p] + people[q]):
+                        continue
+                    merged_values = [topic_values[p][t] + topic_values[q][t] for t in range(self.num_topics)]
+                    t = best_topic(merged_values)
+                    delta = (merged_values[t] - topic_values[p][topics[p]] - topic_values[q][topics[q]]
+                             + penalty[people[p] + people[q]] - penalty[people[p]] - penalty[people[q]])
+                    if delta > 0:
+                        for g in list(members[q]):
+                            move(g, q, p)
+                        topics[p] = t
+                        gain += delta
+                        improved = True
+
+                # Splits into two project groups (the first member always stays, so each split is only tried once)
+                if people[p] >= 2 * self.min_group_size:
+                    for mask in range(2, 2 ** len(members[p]), 2):
+                        part = [g for i, g in enumerate(members[p]) if mask >> i & 1]
+                        part_people = sum(sizes[g] for g in part)
+                        if not (fits(part_people) and fits(people[p] - part_people)):
+                            continue
+                        part_values = [sum(values[g][t] for g in part) for t in range(self.num_topics)]
+                        rest_values = [topic_values[p][t] - part_values[t] for t in range(self.num_topics)]
+                        t_part, t_rest = best_topic(part_values), best_topic(rest_values)
+                        delta = (part_values[t_part] + rest_values[t_rest] - topic_values[p][topics[p]]
+                                 + penalty[part_people] + penalty[people[p] - part_people] - penalty[people[p]])
+                        if delta > 0:
+                            members.append([])
+                            topics.append(t_part)
+                            people.append(0)
+                            topic_values.append([0] * self.num_topics)
+                            for g in part:
+                                move(g, p, len(members) - 1)
+                            topics[p] = t_rest
+                            gain += delta
+                            improved = True
+                            break
+
+        self.trial_metrics['local_search_gain'] = gain
+        return gain, [(members[p], topics[p]) for p in range(len(members)) if members[p]]
+
+    def split_into_groups(self, singles, pairs):
+        """
+        Find the best way to split the singles and pairs allocated to one topic into project groups
+        of MIN_GROUP_SIZE to MAX_GROUP_SIZE people, without splitting any pair.
+        :param singles: Number of single-person preference groups
+        :param pairs: Number of two-person preference groups
+        :return: - Total odd size penalty, or NEGATIVE_INFINITY if impossible
+                 - List of 2-tuples (singles, pairs) giving the make-up of each project group
+        """
+        if (singles, pairs) in self.split_cache:
+            return self.split_cache[(singles, pairs)]
+        best_penalty, best_split = (0, []) if singles == 0 and pairs == 0 else (NEGATIVE_INFINITY, [])
+        for num_pairs in range(min(pairs, self.max_group_size // 2) + 1):
+            for num_singles in range(max(self.min_group_size - 2 * num_pairs, 0), min(singles, self.max_group_size - 2 * num_pairs) + 1):
+                if num_singles + num_pairs == 0:
+                    continue
+                penalty, split = self.split_into_groups(singles - num_singles, pairs - num_pairs)
+                if penalty == NEGATIVE_INFINITY:
+                    continue
+                penalty += self.odd_size_group_penalty if num_singles + 2 * num_pairs != self.group_size else 0
+                if penalty > best_penalty:
+                    best_penalty, best_split = penalty, [(num_singles, num_pairs)] + split
+        self.split_cache[(singles, pairs)] = (best_penalty, best_split)
+        return best_penalty, best_split
+
+    def add_to_summary(self, summary, num_ppl, count):
+        """
+        Update the summary of a topic's allocation (see solve_classes) after count preference groups of num_ppl people join it.
+        :param summary: 2-tuple (people, singles), capped as described in CLASS_PEOPLE_CAP and CLASS_SINGLES_CAP
+        :return: New summary
+        """
+        people, singles = summary
+        people += num_ppl * count
+        if people >= self.class_people_cap:
+            people = self.class_people_cap + (people - self.class_people_cap) % self.group_size
+        if num_ppl == 1:
+            singles = min(singles + count, self.class_singles_cap)
+        return people, singles
+
+    def summary_penalty(self, summary):
+        """
+        Calculate the total odd size penalty of a topic from the summary of its allocation.
+        :return: Penalty, or NEGATIVE_INFINITY if the people allocated to this topic cannot be split into valid groups
+        """
+        people, singles = summary
+        if singles == self.class_singles_cap and (people - singles) % 2 != 0:
+            singles += 1  # Any number of singles above the cap works the same, as long as the pairs add up
+        if singles > people:
+            return NEGATIVE_INFINITY
+        return self.split_into_groups(singles, (people - singles) // 2)[0]
+
+    def solve_classes(self, budget_limit=None):
+        """
+        Exact alternative to the DP trials (SOLVER = 'classes').
+
+        Preference groups with the same size and the same value for every topic are interchangeable, so they are
+        collapsed into classes, and the solver decides how many members of each class go to each topic.
+        The best penalty of a topic only depends on how many people and how many singles it gets (see split_into_groups),
+        and beyond small numbers only on the number of people mod GROUP_SIZE, so each topic is summarized by these
+        two numbers (capped). A DP over classes then keeps the lowest value loss (compared to every group getting
+        its best topic) for every combination of topic summaries, only allowing a total loss within a budget.
+        Classes that are equally happy with any topic are "free", and are only distributed at the very end,
+        one topic at a time; once a topic has received its free members, its penalty is final.
+        The budget starts at 0 and is raised until the best allocation found is within it, which proves it optimal.
+        Losses and values are counted in units of 1/scale, and each member that does not get its best topic loses one
+        more unit, so that topics tied with the best one cost a little budget rather than none (which would let the
+        DP try every way of splitting a class between them at once); with more units per value than groups, this only
+        breaks ties between allocations of the same value. Ties still make the DP much larger: once the budget covers
+        the penalties, members of a tied class can be split between its best topics in every way. If the DP needs more
+        than CLASS_MAX_STATES topic summaries, the solver gives up with TooManyStates.
+        :param budget_limit: If set, the budget is not raised beyond it, so only the best allocation whose value loss is
+            within it is found (see upper_bound)
+        :return: - Objective value, or NEGATIVE_INFINITY if there are no feasible allocations
+                 - Project group allocation (same format as traceback)
+        """
+        # Collapse groups into classes, shuffling members so that ties are broken randomly
+        members_by_class = {}
+        for group in range(len(self.groups)):
+            members_by_class.setdefault((len(self.groups[group]), tuple(self.group_values[group])), []).append(group)
+        for members in members_by_class.values():
+            self.random.shuffle(members)
+        classes = [key for key in members_by_class.keys() if len(set(key[1])) > 1]
+        free_singles = [g for (size, values), members in members_by_class.items()
+                        if size == 1 and len(set(values)) == 1 for g in members]
+        free_pairs = [g for (size, values), members in members_by_class.items()
+                      if size == 2 and len(set(values)) == 1 for g in members]
+        best_total = sum(max(self.group_values[group]) for group in range(len(self.groups)))
+        scale = len(self.groups) + 1  # Units per value, more than the number of members that can deviate
+        max_loss = sum(len(members_by_class[key]) * ((max(key[1]) - min(v for v in key[1] if v != NEGATIVE_INFINITY))
+                                                     * scale + 1) for key in classes)
+
+        def deviations(num_left, topic_losses, budget):
+            """
+            Generate all ways for some members of a class to not get their best topic, within a loss budget.
+            :param topic_losses: List of (topic, loss per member) for all other allowed topics
+            :return: Generator of lists of (topic, count)
+            """
+            if not topic_losses:
+                yield []
+                return
+            topic, loss = topic_losses[0]
+            for count in range(min(num_left, budget // loss) + 1):
+                for rest in deviations(num_left - count, topic_losses[1:], budget - count * loss):
+                    yield ([(topic, count)] if count else []) + rest
+
+        def search(budget):
+            """
+            Run the DP over classes, only allowing allocations whose total value loss (in units) is within budget.
+            :return: - Best objective value found, in units and relative to best_total (NEGATIVE_INFINITY if none)
+                     - For each class, list of (topic, count)
+                     - For each topic, 2-tuple (free singles, free pairs)
+            """
+            empty = (0, 0)
+            row = {(empty,) * self.num_topics: 0}  # Maps topic summaries to negative value loss
+            back = []  # For each class, dict mapping new topic summaries to (old summaries, list of (topic, count))
+            num_states = 0  # Topic summaries kept in all rows so far (see CLASS_MAX_STATES)
+
+            def check_states(new_row):
+                if num_states + len(new_row) > CLASS_MAX_STATES:
+                    raise TooManyStates("The classes solver needs more than %d states with a loss budget of %d units."
+                                        % (CLASS_MAX_STATES, budget))
+
+            for num_ppl, values in classes:
+                num_members = len(members_by_class[(num_ppl, values)])
+                best_topic = values.index(max(values))
+                topic_losses = [(topic, (values[best_topic] - values[topic]) * scale + 1) for topic in range(self.num_topics)
+                                if topic != best_topic and values[topic] != NEGATIVE_INFINITY]
+                loss_by_topic = dict(topic_losses)
+                new_row, back_row = {}, {}
+                for state, score in row.items():
+                    for deviation in deviations(num_members, topic_losses, budget + score):
+                        new_score = score - sum(count * loss_by_topic[topic] for topic, count in deviation)
+                        counts = deviation + [(best_topic, num_members - sum(count for _, count in deviation))]
+                        new_state = list(state)
+                        for topic, count in counts:
+                            new_state[topic] = self.add_to_summary(new_state[topic], num_ppl, count)
+                        new_state = tuple(new_state)
+                        if new_row.get(new_state, NEGATIVE_INFINITY) < new_score:
+                            new_row[new_state] = new_score
+                            back_row[new_state] = (state, counts)
+                    check_states(new_row)
+                row = new_row
+                back.append(back_row)
+                num_states += len(row)
+
+            # Distribute free members one topic at a time; whatever is left over forms groups of its own (on any topic).
+            # More than CLASS_PEOPLE_CAP + GROUP_SIZE free people per topic never helps (see add_to_summary).
+            row = {(state, 0, 0): score for state, score in row.items()}
+            free_back = []
+            for topic in range(self.num_topics):
+                new_row, back_row = {}, {}
+                for (state, used_singles, used_pairs), score in row.items():
+                    for num_singles in range(min(self.class_people_cap + self.group_size, len(free_singles) - used_singles + 1)):
+                        for num_pairs in range(min((self.class_people_cap + self.group_size) // 2, len(free_pairs) - used_pairs + 1)):
+                            summary = self.add_to_summary(self.add_to_summary(state[topic], 1, num_singles), 2, num_pairs)
+                            penalty = self.summary_penalty(summary)
+                            if penalty == NEGATIVE_INFINITY:
+                                continue
+                            penalty *= scale
+                            new_state = (state[:topic] + (None,) + state[topic+1:],
+                                         used_singles + num_singles, used_pairs + num_pairs)
+                            if new_row.get(new_state, NEGATIVE_INFINITY) < score + penalty:
+                                new_row[new_state] = score + penalty
+                                back_row[new_state] = ((state, used_singles, used_pairs), num_singles, num_pairs)
+                    check_states(new_row)
+                row = new_row
+                free_back.append(back_row)
+                num_states += len(row)
+
+            best_state, best_score = None, NEGATIVE_INFINITY
+            for state, score in row.items():
+                penalty = self.split_into_groups(len(free_singles) - state[1], len(free_pairs) - state[2])[0]
+                if penalty != NEGATIVE_INFINITY and score + penalty * scale > best_score:
+                    best_state, best_score = state, score + penalty * scale
+            if best_state is None:
+                return NEGATIVE_INFINITY, [], []
+
+            # Traceback
+            free_counts = [None] * self.num_topics
+            state = best_state
+            for topic in range(self.num_topics - 1, -1, -1):
+                state, num_singles, num_pairs = free_back[topic][state]
+                free_counts[topic] = (num_singles, num_pairs)
+            state = state[0]
+            class_counts = [None] * len(classes)
+            for i in range(len(classes) - 1, -1, -1):
+                state, class_counts[i] = back[i][state]
+            return best_score, class_counts, free_counts
+
+        budget = 0
+        while True:
+            score, class_counts, free_counts = search(budget)
+            if score >= -budget or budget >= max_loss:
+                break  # Any allocation with a larger loss is worse than this one
+            if budget_limit is not None and budget >= budget_limit * scale:
+                break
+            # Small budgets keep the DP small, so grow it gradually rather than jumping straight to the current gap
+            budget = min(max(2 * budget, 1), -score, max_loss)
+        if score == NEGATIVE_INFINITY:
+            return NEGATIVE_INFINITY, []
+        value = best_total - (-score // scale)  # Rounds the tie-breaking units away
+
+        # Expand back into concrete project groups
+        singles_by_topic = [[] for _ in range(self.num_topics)]
+        pairs_by_topic = [[] for _ in range(self.num_topics)]
+        for key, counts in zip(classes, class_counts):
+            members = members_by_class[key]
+            target = singles_by_topic if key[0] == 1 else pairs_by_topic
+            for topic, count in counts:
+                target[topic] += members[:count]
+                members = members[count:]
+        for topic, (num_singles, num_pairs) in enumerate(free_counts):
+            singles_by_topic[topic] += free_singles[:num_singles]
+            free_singles = free_singles[num_singles:]
+            pairs_by_topic[topic] += free_pairs[:num_pairs]
+            free_pairs = free_pairs[num_pairs:]
+
+        project_groups = []
+        for num_singles, num_pairs in self.split_into_groups(len(free_singles), len(free_pairs))[1]:
+            # Leftover free members form groups on any topic
+            project_groups.append((free_singles[:num_singles] + free_pairs[:num_pairs], self.random.randrange(self.num_topics)))
+            free_singles, free_pairs = free_singles[num_singles:], free_pairs[num_pairs:]
+        for topic in range(self.num_topics):
+            singles, pairs = singles_by_topic[topic], pairs_by_topic[topic]
+            self.random.shuffle(singles)
+            self.random.shuffle(pairs)
+            for num_singles, num_pairs in self.split_into_groups(len(singles), len(pairs))[1]:
+                project_groups.append((singles[:num_singles] + pairs[:num_pairs], topic))
+                singles, pairs = singles[num_singles:], pairs[num_pairs:]
+
+        return value, project_groups
+
+    def upper_bound(self):
+        """
+        Upper bound on the objective value of any allocation, from a relaxation that ignores which preference groups
+        are adjacent (so no DP trial can beat it, and a trial that reaches it is optimal).
+        An allocation either gives every preference group its best value, or loses at least the smallest positive
+        difference between a group's best value and another value it allows. The best allocation of the first kind is
+        found exactly by the classes solver with a loss budget of 0, which is fast since no group deviates from its best
+        topics. Any other allocation gets at most the sum of best values minus that difference, plus the best penalty
+        of splitting all singles and pairs into groups as if topics did not matter.
+        If a group has several best topics (tied PREF_VALUES), allocations of the first kind can split it between them,
+        which the classes solver cannot do with a budget of 0, so the bound is only the sum of best values plus that
+        penalty (the same goes if the classes solver gives up, see CLASS_MAX_STATES).
+        The classes solver needs an even GROUP_SIZE, so there is no bound otherwise.
+        :return: Upper bound, NEGATIVE_INFINITY if there are no feasible allocations, or None if GROUP_SIZE is odd
+        """
+        if self.group_size % 2 != 0:
+            return None
+        self.precompute_group_values()
+        best_total = sum(max(values) for values in self.group_values)
+        min_loss = min((max(values) - value for values in self.group_values for value in values
+                        if NEGATIVE_INFINITY < value < max(values)), default=None)
+        singles = sum(1 for group in self.groups if len(group) == 1)
+        penalty = self.split_into_groups(singles, len(self.groups) - singles)[0]
+        if penalty == NEGATIVE_INFINITY:  # Every allocation splits everyone into groups somehow
+            return NEGATIVE_INFINITY
+        if any(len(set(values)) > 1 and values.count(max(values)) > 1 for values in self.group_values):
+            return best_total + penalty
+        try:
+            bound = self.solve_classes(budget_limit=0)[0]
+        except TooManyStates:
+            return best_total + penalty
+        if min_loss is not None:
+            bound = max(bound, best_total - min_loss + penalty)
+        return bound
+
+    def output(self, project_groups, filename):
+        """
+        Prints the group allocations to an output file in a human-readable format.
+        :param project_groups: List of tuples containing each project group's members (using preference group IDs) and topic, as follows:
+            [([29, 41, 59], 3), ([1, 35], 5), ([27, 3], 2), ...]
+        :param filename: Name of output file
+        """
         #print(project_groups)
-        #print(leftovers)
+        with open(filename, 'w') as f:
+            for proj_group in project_groups:
+                person_ids = [person_id for group_id in proj_group[0] for person_id in self.groups[group_id]]
+                strs = [self.netids[id] for id in person_ids] + [str(proj_group[1] + 1)]
+                f.write(','.join(strs) + '\n')
+
+    def run(self):
+        """
+        Perform one run of the algorithm.
+
+        Since the DP is dependent on the shuffled order of groups and may not always give a globally optimal solution,
+        several runs are needed to reshuffle the groups and (hopefully) find a reasonable maximum.
+        :return: - Objective value from this run
+                 - Project group allocation from this run
+                 - Shuffled order of preference groups used by this run (see shuffle_groups)
+        """
+        self.f = []
+        self.alloc = []
+        phases = self.trial_metrics['phases']
+
+        with timed(phases, 'dp'):
+            order = self.shuffle_groups()
+            self.precompute_group_values()
+            self.dp()
+
+        """for g in range(len(groups)+1):
+            print(g)
+            print(f[g])
+            print(alloc[g])"""
+
+        with timed(phases, 'find_maxima'):
+            max_states, max_value = self.find_maxima()
+        if not max_states:
+            return NEGATIVE_INFINITY, [], order
+        max_state = self.random.choice(max_states)
+        with timed(phases, 'traceback'):
+            project_groups = self.traceback(max_state)
+        if self.local_search:
+            with timed(phases, 'local_search'):
+                gain, project_groups = self.improve(project_groups)
+            max_value += gain
+
+        return max_value, project_groups, order
+
+    def rerun(self, filename):
+        """
+        Re-solve incrementally after the preference file has changed (e.g. late or edited submissions),
+        reusing the DP table of the last run().
+
+        Preference groups that did not change keep their (shuffled) order from the last run and go first,
+        followed by changed and new groups in random order. The rows of the DP table are kept for the longest
+        prefix of the last run's order in which nothing changed, and only the remaining rows are recomputed.
+        (Rows can only be reused if the last run kept all of them, i.e. with the 'dict' engine,
+        without LOW_MEMORY, PRUNE_STATES, RECOMPUTE_TRACEBACK or checkpoints; otherwise the whole table is recomputed.)
+        :param filename: Name of the updated preference file
+        :return: Same as run(), with the shuffled order referring to the groups as read from the updated file
+        """
+        old_groups, old_prefs = self.groups, self.prefs
+        self.groups, self.prefs = [], []
+        self.read_prefs(filename)
+        new_groups, new_prefs = self.groups, self.prefs
+
+        # Match unchanged groups (same members and preferences) of the last run with the updated file
+        new_indexes = {}
+        for i in range(len(new_groups)):
+            new_indexes.setdefault((tuple(sorted(new_groups[i])), tuple(new_prefs[i])), []).append(i)
+        order = []
+        start = 0  # Number of leading groups of the last run with no changes
+        for i in range(len(old_groups)):
+            matches = new_indexes.get((tuple(sorted(old_groups[i])), tuple(old_prefs[i])))
+            if matches:
+                order.append(matches.pop())
+                if start == i:
+                    start += 1
+        changed = sorted(set(range(len(new_groups))) - set(order))
+        self.random.shuffle(changed)
+        order += changed
+
+        if self.retired_states:  # Rows from the first retirement on depend on all groups after them
+            start = min(start, min(self.retired_states) - 1)
+        can_reuse = (self.dp_engine == 'dict' and not self.prune_states and self.checkpoint_filename is None
+                     and not self.recompute_traceback and len(self.f) > start and isinstance(self.f[start], dict))
+        if not can_reuse:
+            start = 0
+            self.f.clear()
+            self.alloc.clear()
+        print("Reusing DP rows for %d of %d groups." % (start, len(order)))
+
+        self.groups = [new_groups[i] for i in order]
+        self.prefs = [new_prefs[i] for i in order]
+        self.precompute_group_values()
+        self.dp(start)
+
+        max_states, max_value = self.find_maxima()
+        if not max_states:
+            return NEGATIVE_INFINITY, [], order
+        max_state = self.random.choice(max_states)
+        project_groups = self.traceback(max_state)
+        if self.local_search:
+            gain, project_groups = self.improve(project_groups)
+            max_value += gain
+
+        return max_value, project_groups, order
+
+    def run_trial(self, seed, profile=False, deadline=None):
+        """
+        Perform one trial of the algorithm with its own random seed, always starting from the unshuffled preference groups.
+        Runs either in this process or in a worker process (see init_worker).
+        If the trial is abandoned (TrialAbandoned or KeyboardInterrupt), the allocator is still left ready for the next one.
+        :param seed: Random seed of this trial (see trial_seed)
+        :param profile: Whether to run this trial under cProfile and tracemalloc (see PROFILE_TRIAL)
+        :param deadline: Time (as in time.time()) at which the trial is abandoned with TrialAbandoned (None: never)
+        :return: Same as run(), plus the metrics of this trial
+        """
+        original_groups, original_prefs = self.groups, self.prefs
+        self.current_seed = seed
+        self.deadline = deadline
+        self.trial_metrics = {'seed': seed, 'phases': {}, 'rows': []}
+        self.random.seed(seed)
+        if profile:
+            profiler = cProfile.Profile()
+            tracemalloc.start()
+            profiler.enable()
+        try:
+            result = self.run()
+        finally:
+            if profile:
+                profiler.disable()
+                profiler.dump_stats(self.profile_filename)
+                snapshot = tracemalloc.take_snapshot()
+                self.trial_metrics['profile'] = self.profile_filename
+                self.trial_metrics['traced_memory_peak'] = tracemalloc.get_traced_memory()[1]
+                self.trial_metrics['top_allocations'] = [str(stat) for stat in snapshot.statistics('lineno')[:10]]
+                tracemalloc.stop()
+            if self.checkpoint_file is not None:  # Abandoned during the DP; what was written can still be resumed
+                self.checkpoint_file.close()
+                self.checkpoint_file = None
+            self.deadline = None
+            self.groups, self.prefs = original_groups, original_prefs
+            self.f, self.alloc, self.retired_states = [], [], {}  # Free DP tables before the next trial
+        return result + (self.trial_metrics,)
+
+    def load(self, netid_filename=NETID_FILENAME, pref_filename=PREFERENCE_FILENAME):
+        """
+        Read the roster to allocate.
+        :param netid_filename: Name of NetID file
+        :param pref_filename: Name of preference file
+        """
+        self.groups, self.prefs = [], []
+        with timed(self.metrics['phases'], 'read_prefs'):
+            self.read_netids(netid_filename)
+            self.read_prefs(pref_filename)
+
+    def solve(self, trials=NUM_TRIALS, seed=SEED, on_trial=None, pool=None):
+        """
+        Find the best allocation of the loaded roster over several trials (or with the exact solver, see SOLVER).
+        Afterwards, groups and prefs are in the order that the best allocation refers to.
+        Trials stop early at TIME_LIMIT, after PATIENCE trials without improvement, on Ctrl+C or on cancel()
+        (see trial_results).
+        :param trials: Maximum number of random trials (None: no maximum, which needs TIME_LIMIT or PATIENCE)
+        :param seed: Base random seed; each trial is seeded from (seed, trial number)
+            If None: a base seed is picked at random (and printed)
+        :param on_trial: Function called with the trial number (1-indexed), objective value and metrics of each trial
+            as it is done (see collect)
+        :param pool: Worker processes shared with other allocators to run the trials on (see worker_pool and
+            trial_results). If None: as set by NUM_WORKERS
+        :return: Best objective value (also kept in self.value, and the allocation in self.project_groups),
+            or NEGATIVE_INFINITY if no valid allocations were found
+        """
+        if trials is None and self.time_limit is None and self.patience is None and self.solver != 'classes':
+            raise ValueError("An unlimited number of trials needs TIME_LIMIT or PATIENCE.")
+        base_seed = seed if seed is not None else self.random.randrange(2 ** 32)
+        print("Base random seed: %d" % base_seed)
+        print()
+
+        self.f, self.alloc = [], []
+        if self.solver == 'classes':  # Exact, so no trials needed
+            results = [self.run_classes(base_seed)]
+        else:
+            results = self.trial_results(base_seed, trials, pool)
+        return self.collect(base_seed, results, trials, on_trial)
+
+    def cancel(self):
+        """
+        Cancel the solve running in another thread (e.g. by solve_events): the trial that is running stops at the next
+        row of its DP, no more trials are started, and solve() returns the best allocation so far.
+        Trials already running in worker processes (NUM_WORKERS > 1 or a pool) also stop at their next row if the solve
+        was started by solve_events, and are finished first otherwise.
+        """
+        self.cancelled = True
+        if self.cancel_event is not None:
+            self.cancel_event.set()
+
+    async def solve_events(self, trials=NUM_TRIALS, seed=SEED, executor=None, pool=None):
+        """
+        Solve like solve(), in a thread of executor so that the event loop it is called from is not blocked,
+        and yield progress events as it goes (e.g. to stream them from an async web service).
+        Events are dicts: {'event': 'row', ...} with the stats of report_row for each DP row (from worker processes too,
+        through a queue of event_manager), {'event': 'trial', 'trial', 'seed', 'value'} for each trial, and finally
+        {'event': 'done', 'value', 'upper_bound'} (None if no valid allocations were found, or for upper_bound if
+        GAP_TOLERANCE is None).
+        Stopping the iteration early, or cancelling the task that runs it, cancels the solve (see cancel), including
+        trials running in worker processes, and waits for it to stop. Each concurrent solve needs an allocator of its own.
+        :param trials: Same as solve()
+        :param seed: Same as solve()
+        :param executor: concurrent.futures executor to solve in
+            If None: a thread of its own, so that concurrent solves never wait for each other's threads
+        :param pool: Same as solve(). Trials in threads share the interpreter lock, so with dozens of concurrent solves,
+            a pool shared by all of them keeps the event loop responsive, as the thread then only waits for the workers
+        :return: Async generator of events
+        """
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+        progress_callback = self.progress_callback
+
+        def report(event):  # Called in the solving thread
+            loop.call_soon_threadsafe(events.put_nowait, event)
+
+        def report_row(stats):
+            report(dict(stats, event='row'))
+            if progress_callback is not None:
+                progress_callback(stats)
+
+        def report_trial(trial, value, metrics):
+            report({'event': 'trial', 'trial': trial, 'seed': metrics['seed'],
+                    'value': value if value > NEGATIVE_INFINITY else None})
+
+        def forward_rows(row_queue):  # Called in a thread of its own, with trials in worker processes
+            while True:
+                stats = row_queue.get()
+                if stats is None:
+                    break
+                report_row(stats)
+
+        def run_solve():
+            try:
+                try:
+                    value = self.solve(trials, seed, report_trial, pool)
+                finally:
+                    if forwarder is not None:  # Forward the rows of all trials before the solve ends
+                        self.row_queue.put(None)
+                        forwarder.join()
+                report({'event': 'done', 'value': value if value > NEGATIVE_INFINITY else None,
+                        'upper_bound': self.metrics['upper_bound']})
+            finally:
+                report(None)
+
+        self.cancelled = False
+        forwarder = None
+        if self.num_workers == 1 and pool is None:
+            self.progress_callback = report_row
+        else:  # Workers get a copy of the allocator, so rows and cancelling go through a manager process instead
+            manager = event_manager()
+            self.row_queue, self.cancel_event = manager.Queue(), manager.Event()
+            forwarder = threading.Thread(target=forward_rows, args=(self.row_queue,), daemon=True)
+            forwarder.start()
+        own_executor = executor is None
+        if own_executor:
+            executor = ThreadPoolExecutor(max_workers=1)
+        solving = loop.run_in_executor(executor, run_solve)
+        try:
+            while True:
+                event = await events.get()
+                if event is None:
+                    break
+                yield event
+            await solving  # Raises what solve() raised, if anything
+        finally:
+            if not solving.done():
+                self.cancel()
+                await asyncio.wait([solving])
+            self.progress_callback = progress_callback
+            self.row_queue, self.cancel_event = None, None
+            if own_executor:
+                executor.shutdown(wait=False)
+
+    async def solve_async(self, trials=NUM_TRIALS, seed=SEED, executor=None, pool=None):
+        """
+        Same as solve(), but awaitable, without blocking the event loop (see solve_events).
+        :return: Same as solve()
+        """
+        async for _ in self.solve_events(trials, seed, executor, pool):
+            pass
+        return self.value
+
+    def trial_results(self, base_seed, trials, pool=None):
+        """
+        Run trials one after another, or NUM_WORKERS at a time in worker processes, until there have been enough of them,
+        TIME_LIMIT runs out, PATIENCE trials in a row bring no improvement, the best allocation is within GAP_TOLERANCE of
+        the upper bound (see upper_bound), Ctrl+C is pressed, or the solve is cancelled.
+        A trial that is still running at that point is abandoned, and the results so far are kept.
+        :param base_seed: Base random seed of the trials
+        :param trials: Maximum number of trials (None: no maximum)
+        :param pool: Worker processes shared with other allocators (see AllocationServer), which get this allocator
+            with each trial; NUM_WORKERS trials at a time run on them, even if it is 1 (and it may change meanwhile).
+            If None: worker processes of its own if NUM_WORKERS > 1
+        :return: Generator of the results of run_trial(), in trial order
+        """
+        deadline = time.time() + self.time_limit if self.time_limit is not None else None
+        self.bound = None
+        if self.gap_tolerance is not None:
+            with timed(self.metrics['phases'], 'upper_bound'):
+                self.bound = self.upper_bound()
+            if self.bound is not None and self.bound > NEGATIVE_INFINITY:
+                print("Upper bound on the objective value: %d" % self.bound)
+                print()
+        shared_pool = pool is not None
+        if pool is None and self.num_workers > 1:
+            pool = ProcessPoolExecutor(max_workers=self.num_workers, initializer=init_worker, initargs=([self],))
+        jobs = deque()  # Trials running in worker processes, oldest first
+        max_value = NEGATIVE_INFINITY
+        last_improvement = 0  # Number of trials done when the best value so far was found
+        done = 0
+        try:
+            while trials is None or done < trials:
+                if self.cancelled:
+                    raise SolveCancelled("Cancelled after %d trials." % done)
+                if pool is None:
+                    result = self.run_trial(trial_seed(base_seed, done), done+1 == self.profile_trial, deadline)
+                else:
+                    # Keep every worker busy, but take results in trial order so that the outcome is the same
+                    while len(jobs) < self.num_workers and (trials is None or done + len(jobs) < trials):
+                        trial = done + len(jobs)
+                        jobs.append(pool.submit(run_worker_trial, trial_seed(base_seed, trial),
+                                                trial+1 == self.profile_trial, 0, deadline,
+                                                self if shared_pool else None))
+                    result = jobs.popleft().result()
+                done += 1
+                yield result
+                if result[0] > max_value:
+                    max_value, last_improvement = result[0], done
+                if self.bound is not None and NEGATIVE_INFINITY < self.bound - self.gap_tolerance <= max_value:
+                    if max_value >= self.bound:
+                        print("The best allocation so far reaches the upper bound, so no more trials are run.")
+                    else:
+                        print("The best allocation so far is within %s of the upper bound, so no more trials are run."
+                              % self.gap_tolerance)
+                    break
+                if self.patience is not None and done - last_improvement >= self.patience:
+                    print("No better allocation in the last %d trials, so no more trials are run." % self.patience)
+                    break
+                if deadline is not None and time.time() >= deadline:
+                    print("Time limit of %s seconds reached after %d trials." % (self.time_limit, done))
+                    break
+        except TrialAbandoned:
+            print("Time limit of %s seconds reached; trial %d was abandoned." % (self.time_limit, done+1))
+        except KeyboardInterrupt:
+            print("Interrupted; trial %d was abandoned, keeping the best allocation so far." % (done+1))
+        except SolveCancelled:
+            print("Cancelled after %d trials, keeping the best allocation so far." % done)
+        finally:
+            if shared_pool:
+                for job in jobs:
+                    job.cancel()
+            elif pool is not None:
+                pool.shutdown(cancel_futures=True)
+        print()
+
+    def run_classes(self, seed):
+        """
+        Solve with the exact solver (SOLVER = 'classes'), which takes the place of all trials.
+        :param seed: Random seed, only used to break ties
+        :return: Same as run_trial()
+        """
+        self.current_seed = seed
+        self.trial_metrics = {'seed': seed, 'phases': {}, 'rows': []}
+        self.random.seed(seed)
+        with timed(self.trial_metrics['phases'], 'solve_classes'):
+            self.precompute_group_values()
+            value, project_groups = self.solve_classes()
+        return value, project_groups, list(range(len(self.groups))), self.trial_metrics
+
+    def collect(self, base_seed, results, trials, on_trial=None):
+        """
+        Keep the best allocation out of the results of all trials (see solve), reporting each trial as it arrives.
+        Afterwards, groups and prefs are in the order that the best allocation refers to.
+        :param base_seed: Base random seed of the trials
+        :param results: Results of run_trial() (or the one result of run_classes()), in trial order
+        :param trials: Maximum number of trials, only for reporting (None: no maximum)
+        :param on_trial: Same as solve()
+        :return: Same as solve()
+        """
+        max_value = NEGATIVE_INFINITY
+        project_groups = []
+        best_order = []
+        all_trial_metrics = []
+        for i, (value, proj_group, order, metrics) in enumerate(results):
+            if self.solver != 'classes':
+                print("[Trial %s] Objective value: %s (seed %s)" % (
+                    i+1 if trials is None else '%d / %d' % (i+1, trials),
+                    value if value > NEGATIVE_INFINITY else 'infeasible', metrics['seed']))
+                if metrics.get('local_search_gain'):
+                    print("Local search improved this trial's allocation by %d." % metrics['local_search_gain'])
+                if 'profile' in metrics:
+                    print("Profile of this trial written to %s." % metrics['profile'])
+                print()
+            if on_trial is not None:
+                on_trial(i+1, value, metrics)
+            metrics['value'] = value if value > NEGATIVE_INFINITY else None
+            all_trial_metrics.append(metrics)
+            if value > max_value:
+                max_value = value
+                project_groups = proj_group
+                best_order = order  # Project groups refer to preference groups in this order
+
+        if max_value <= NEGATIVE_INFINITY:
+            print("ERROR: No valid group allocations found.")
+        else:
+            print("Optimal group allocation has an objective score of %d." % max_value)
+            if self.bound is not None and self.bound > NEGATIVE_INFINITY:
+                if max_value >= self.bound:
+                    print("It reaches the upper bound, so no allocation is better.")
+                else:
+                    print("Gap to the upper bound: %d (no allocation is better by more than this)." % (self.bound - max_value))
+            self.groups = [self.groups[i] for i in best_order]
+            self.prefs = [self.prefs[i] for i in best_order]
+        self.value = max_value
+        self.project_groups = project_groups
+        self.metrics.update({
+            'base_seed': base_seed,
+            'value': max_value if max_value > NEGATIVE_INFINITY else None,
+            'upper_bound': self.bound if self.bound is not None and self.bound > NEGATIVE_INFINITY else None,
+            'trials': all_trial_metrics,
+        })
+        return max_value
+
+    def write(self, filename=OUTPUT_FILENAME):
+        """
+        Write the best allocation found by solve().
+        :param filename: Name of output file
+        """
+        with timed(self.metrics['phases'], 'output'):
+            self.output(self.project_groups, filename)
 
-    # Sanity check: Form all leftovers as groups
-    # Should not need this, but just in case
-    for topic in range(NUM_TOPICS):
-        form_group(topic)
 
-    return project_groups
+    def top_allocations(self, k, seed=SEED):
+        """
+        Generate the k best distinct allocations of one trial, best first, from a single DP pass
+        (e.g. to give instructors alternatives to choose from).
+
+        Each state of the DP keeps its k best incoming transitions instead of only the best one, so the k best
+        paths through the DP table end at these transitions. They are enumerated lazily, best first, by extending
+        each state's list of best paths only when a later path needs it (recursive enumeration of k shortest paths),
+        so each allocation after the first costs about one traceback. Paths that lead to an allocation already
+        generated are skipped, so there can be fewer than k.
+        The DP always uses the 'dict' engine, without PRUNE_STATES or checkpoints, and local search is not applied.
+        Afterwards, groups and prefs are in the shuffled order that the allocations refer to.
+        :param k: Maximum number of allocations
+        :param seed: Base random seed; the DP is the same as in the first trial of solve() with this seed
+            If None: a base seed is picked at random
+        :return: Generator of 2-tuples (objective value, project group allocation (same format as traceback))
+        """
+        base_seed = seed if seed is not None else self.random.randrange(2 ** 32)
+        self.current_seed = trial_seed(base_seed, 0)
+        self.trial_metrics = {'seed': self.current_seed, 'phases': {}, 'rows': []}
+        self.random.seed(self.current_seed)
+        self.shuffle_groups()
+        self.precompute_group_values()
+        self.f, self.alloc = [], []
+        self.num_candidates = k
+        try:
+            self.dp()
+        finally:
+            self.num_candidates = 0
+        num_rows = len(self.groups)
+
+        # Sink after the last row, whose transitions are the final states with the penalties of their leftovers
+        sink = []
+        final_row = self.f[-1]
+        for state, value in final_row.items():
+            penalty = self.final_penalty(state)
+            if penalty != NEGATIVE_INFINITY:
+                sink.append((value + penalty, state, None))
+        self.candidates.append({None: sink})
+        self.f, self.alloc = [], []  # Not needed any more, candidates have everything
+
+        # For each reached (row, state): [best paths found so far, heap of next path candidates, last path taken]
+        # Each path is a 3-tuple (value, transition, index of the path to the old state that it extends)
+        nodes = {(0, self.encode_state((0,) * self.num_topics)): [[(0, None, -1)], [], None]}
+        counter = 0  # Breaks ties in the heaps, so that transitions are never compared
+
+        def old_key(row, transition):
+            return row - 1, (transition[2][0] if row <= num_rows else transition[1])
+
+        def get_node(row, state):
+            node = nodes.get((row, state))
+            if node is None:
+                # The best path through each transition extends the best path to its old state
+                heap = [(-transition[0], i, transition, 0) for i, transition in enumerate(self.candidates[row][state])]
+                heapq.heapify(heap)
+                node = nodes[(row, state)] = [[], heap, None]
+            return node
+
+        def find_path(row, state, index):
+            """
+            Make sure the paths to a state are found up to the given index (if there are that many).
+            Iterative, since rows can be deeper than the recursion limit.
+            """
+            nonlocal counter
+            stack = [(row, state, index)]
+            while stack:
+                row, state, index = stack[-1]
+                node = get_node(row, state)
+                paths, heap, last = node
+                if len(paths) > index or (not heap and last is None):
+                    stack.pop()
+                    continue
+                if last is not None:
+                    # The next path through the last transition taken extends the next path to its old state
+                    value, transition, old_index = last
+                    old_row, old_state = old_key(row, transition)
+                    old_paths, old_heap, old_last = get_node(old_row, old_state)
+                    if len(old_paths) <= old_index + 1 and (old_heap or old_last is not None):
+                        stack.append((old_row, old_state, old_index + 1))  # Find it first, then come back
+                        continue
+                    if len(old_paths) > old_index + 1:
+                        gain = transition[0] - old_paths[0][0]
+                        counter += 1
+                        heapq.heappush(heap, (-(old_paths[old_index + 1][0] + gain), counter, transition, old_index + 1))
+                    node[2] = None
+                if not heap:
+                    stack.pop()
+                    continue
+                value, _, transition, old_index = heapq.heappop(heap)
+                paths.append((-value, transition, old_index))
+                node[2] = paths[-1]
+
+        seen = set()
+        for index in range(k * k if k else 0):  # Duplicates are rare, but bound the search anyway
+            find_path(num_rows + 1, None, index)
+            paths = nodes[(num_rows + 1, None)][0]
+            if len(paths) <= index:
+                return
+            value, transition, old_index = paths[index]
+            final_state = transition[1]
+            decisions = [None] * num_rows
+            row, state = num_rows, final_state
+            while row > 0:
+                find_path(row, state, old_index)
+                _, transition, old_index = nodes[(row, state)][0][old_index]
+                decisions[row - 1] = (transition[1], transition[2])
+                row, state = old_key(row, transition)
+            project_groups = self.traceback(final_state, decisions)
+            allocation = frozenset((tuple(sorted(members)), topic) for members, topic in project_groups)
+            if allocation in seen:
+                continue
+            seen.add(allocation)
+            yield value, project_groups
+            if len(seen) == k:
+                return
 
 
-def output(project_groups, filename):
+def init_worker(allocators):
     """
-    Prints the group allocations to an output file in a human-readable format.
-    :param project_groups: List of tuples containing each project group's members (using preference group IDs) and topic, as follows:
-        [([29, 41, 59], 3), ([1, 35], 5), ([27, 3], 2), ...]
-    :param filename: Name of output file
+    Set up a worker process for parallel trials with a copy of each allocator (with its parsed, unshuffled roster).
+    This is done once per worker, so the rosters are not sent again with each trial.
+    Ctrl+C is ignored while a worker is idle, and abandons the trial it is running otherwise (see run_worker_trial).
+    Being terminated ends a worker right away (even when started by serve_main, which stops on it instead).
     """
-    #print(project_groups)
-    with open(filename, 'w') as f:
-        for proj_group in project_groups:
-            person_ids = [person_id for group_id in proj_group[0] for person_id in groups[group_id]]
-            strs = [netids[id] for id in person_ids] + [str(proj_group[1] + 1)]
-            f.write(','.join(strs) + '\n')
+    global worker_allocators
+    worker_allocators = allocators
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
 
 
-def run():
+def worker_pool(num_workers):
+    """
+    Start worker processes that run the trials of any allocators sent to them (see AllocationServer and solve_async).
+    :param num_workers: Number of worker processes
+    :return: ProcessPoolExecutor to give as the pool of Allocator.solve
     """
-    Perform one run of the algorithm.
+    return ProcessPoolExecutor(max_workers=num_workers, initializer=init_worker, initargs=([],))
 
-    Since the DP is dependent on the shuffled order of groups and may not always give a globally optimal solution,
-    several runs are needed to reshuffle the groups and (hopefully) find a reasonable maximum.
-    :return: - Objective value from this run
-             - Project group allocation from this run
+
+def event_manager():
+    """
+    Manager process whose queues and events relay row stats and cancelling between solve_events and the trials it runs
+    in worker processes. Started by the first solve_events that needs it, and shared by all later ones.
+    :return: multiprocessing.managers.SyncManager
     """
-    global f
-    global alloc
-    f = []
-    alloc = []
+    global shared_manager
+    with shared_manager_lock:
+        if shared_manager is None:
+            shared_manager = multiprocessing.Manager()
+        return shared_manager
 
-    shuffle_groups()
-    dp()
 
-    """for g in range(len(groups)+1):
-        print(g)
-        print(f[g])
-        print(alloc[g])"""
+def run_worker_trial(seed, profile, cohort=0, deadline=None, allocator=None):
+    """
+    Perform one trial of one allocator in a worker process (see Allocator.run_trial).
+    :param cohort: Index of the allocator among those given to init_worker
+    :param allocator: Allocator sent with this trial instead (see AllocationServer)
+    """
+    if allocator is None:
+        allocator = worker_allocators[cohort]
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    try:
+        if allocator.solver == 'classes':
+            return allocator.run_classes(seed)
+        return allocator.run_trial(seed, profile, deadline)
+    finally:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class AllocationServer:
+    """
+    State of the allocation server ("python main.py serve", see README): a bounded queue of solve jobs, SERVE_JOBS
+    threads that run them, one pool of worker processes that runs the trials of all of them, and the parsed rosters
+    of recent jobs, by the content of their files.
+    """
+    def __init__(self, num_workers, num_jobs=SERVE_JOBS, queue_size=SERVE_QUEUE_SIZE, cache_size=SERVE_CACHE_SIZE):
+        """
+        :param num_workers: Number of worker processes
+        :param num_jobs: Number of jobs run at the same time
+        :param queue_size: Number of jobs that can wait for their turn
+        :param cache_size: Number of parsed rosters kept
+        """
+        self.num_workers = num_workers
+        self.pool = worker_pool(num_workers)
+        self.jobs = queue.Queue(maxsize=queue_size)
+        self.cache_size = cache_size
+        self.rosters = OrderedDict()  # Maps (hashes of both files, parameters that reading depends on) to a parsed roster
+        self.running = []  # Allocators of the jobs being run
+        self.next_job_id = 1
+        self.lock = threading.Lock()  # Guards all of the above (except the pool and queue, which have their own)
+        for _ in range(num_jobs):
+            threading.Thread(target=self.run_jobs, daemon=True).start()
+
+    def check(self, request):
+        """
+        Check that a posted job only sets parameters in SERVE_PARAMETERS, within the size limits SERVE_MAX_..., and only
+        names files in SERVE_INPUT_DIR (roster) and SERVE_OUTPUT_DIR (output), and replace its file names with their full
+        paths. Runs before the job is queued, so refused jobs never build an allocator.
+        :param request: Job as a dict (see README)
+        :raise ValueError: If the job is malformed or not allowed
+        """
+        if not isinstance(request, dict) or 'netids' not in request or 'preferences' not in request:
+            raise ValueError("A job needs at least 'netids' and 'preferences'.")
+        params = request.get('parameters', {})
+        if not isinstance(params, dict):
+            raise ValueError("A job's 'parameters' need to be an object.")
+        refused = sorted(key for key in params if str(key).upper() not in SERVE_PARAMETERS)
+        if refused:
+            raise ValueError("Parameters not allowed in a job: %s." % ', '.join(map(str, refused)))
+
+        # Sizes that the tables built by Allocator() and the DP rows grow with (exponentially in the number of topics)
+        upper_params = {str(key).upper(): value for key, value in params.items()}  # Names are not case-sensitive
+        sizes = {name: upper_params.get(name, globals()[name])
+                 for name in ['NUM_OPTIONS', 'GROUP_SIZE', 'MAX_GROUP_SIZE', 'ENABLE_NON_SPECIFIED']}
+        for name in ['NUM_OPTIONS', 'GROUP_SIZE', 'MAX_GROUP_SIZE']:
+            if not isinstance(sizes[name], int) or isinstance(sizes[name], bool) or sizes[name] < 1:
+                raise ValueError("%s needs to be a positive integer." % name)
+        num_topics = sizes['NUM_OPTIONS'] - (1 if sizes['ENABLE_NON_SPECIFIED'] else 0)
+        if not 1 <= num_topics <= SERVE_MAX_TOPICS:
+            raise ValueError("A job needs 1 to %d topics." % SERVE_MAX_TOPICS)
+        if sizes['GROUP_SIZE'] > SERVE_MAX_GROUP_SIZE:
+            raise ValueError("A job needs a GROUP_SIZE of at most %d." % SERVE_MAX_GROUP_SIZE)
+        if sizes['MAX_GROUP_SIZE'] ** num_topics > SERVE_MAX_STATES:
+            raise ValueError("A job can have at most %d DP states (MAX_GROUP_SIZE ** topics)." % SERVE_MAX_STATES)
+
+        def resolve(filename, directory):
+            if not isinstance(filename, str):
+                raise ValueError("File names need to be strings.")
+            directory = os.path.realpath(directory)
+            path = os.path.realpath(os.path.join(directory, filename))
+            if os.path.commonpath([directory, path]) != directory or path == directory:
+                raise ValueError("%s is outside %s." % (filename, directory))
+            return path
+
+        def check_roster_file(filename, max_lines):
+            # Reads at most max_lines + 1 lines, and refuses files with overly long lines before reading any
+            try:
+                if os.path.getsize(filename) > 100 * max_lines:
+                    raise ValueError("%s is too large for a job." % os.path.basename(filename))
+                with open(filename, 'rb') as f:
+                    if sum(1 for line in itertools.islice(f, max_lines + 1) if line.strip()) > max_lines:
+                        raise ValueError("A job can have at most %d students." % SERVE_MAX_STUDENTS)
+            except OSError as e:
+                raise ValueError("Cannot read %s: %s" % (os.path.basename(filename), e.strerror))
+
+        request['netids'] = resolve(request['netids'], SERVE_INPUT_DIR)
+        request['preferences'] = resolve(request['preferences'], SERVE_INPUT_DIR)
+        check_roster_file(request['netids'], SERVE_MAX_STUDENTS)
+        check_roster_file(request['preferences'], 2 * SERVE_MAX_STUDENTS)
+        if request.get('output'):
+            request['output'] = resolve(request['output'], SERVE_OUTPUT_DIR)
+
+    def submit(self, request):
+        """
+        Add a solve job to the queue.
+        :param request: Job as a dict (see README)
+        :return: Job as a dict, whose 'events' queue gets the progress and result of the job (None after the last one),
+            or None if the queue is full
+        """
+        with self.lock:
+            job = {'id': self.next_job_id, 'request': request, 'events': queue.Queue()}
+            self.next_job_id += 1
+        try:
+            self.jobs.put_nowait(job)
+        except queue.Full:
+            return None
+        job['events'].put({'event': 'queued', 'job': job['id'], 'waiting': self.jobs.qsize()})
+        return job
+
+    def status(self):
+        """
+        :return: Dict of the numbers of workers, running and waiting jobs, and cached rosters
+        """
+        with self.lock:
+            return {'workers': self.num_workers, 'running': len(self.running), 'waiting': self.jobs.qsize(),
+                    'rosters': len(self.rosters)}
 
-    max_states, max_value = find_maxima()
-    if not max_states:
-        return NEGATIVE_INFINITY, []
-    max_state = random.choice(max_states)
-    project_groups = traceback(max_state)
+    def load(self, allocator, netid_filename, pref_filename):
+        """
+        Give an allocator the roster read from two files, parsing them only if no recent job had files with the same
+        content (and the same parameters for reading them).
+        :return: Whether the roster was cached
+        """
+        hashes = []
+        for filename in [netid_filename, pref_filename]:
+            with open(filename, 'rb') as f:
+                hashes.append(hashlib.sha256(f.read()).hexdigest())
+        key = tuple(hashes) + (allocator.enable_non_specified, allocator.non_specified_choice)
+        with self.lock:
+            roster = self.rosters.get(key)
+            if roster is not None:
+                self.rosters.move_to_end(key)
+        if roster is not None:
+            # Shared between jobs, which replace these lists rather than change them (see read_prefs)
+            allocator.netids, allocator.netid_to_index, allocator.groups, allocator.prefs = roster
+            return True
+        allocator.load(netid_filename, pref_filename)
+        with self.lock:
+            self.rosters[key] = allocator.netids, allocator.netid_to_index, allocator.groups, allocator.prefs
+            while len(self.rosters) > self.cache_size:
+                self.rosters.popitem(last=False)
+        return False
+
+    def share_workers(self, allocator, joining):
+        """
+        Add or remove the allocator of a job that starts or ends, and split the worker processes evenly between the jobs
+        that are running (at least one each), through their NUM_WORKERS (see trial_results).
+        """
+        with self.lock:
+            if joining:
+                self.running.append(allocator)
+            else:
+                self.running.remove(allocator)
+            for running_allocator in self.running:
+                running_allocator.num_workers = max(1, self.num_workers // len(self.running))
 
-    return max_value, project_groups
+    def run_jobs(self):
+        """
+        Run jobs from the queue, one after another (in a thread of its own).
+        """
+        while True:
+            job = self.jobs.get()
+            try:
+                self.run_job(job)
+            except Exception as e:  # Reported to the client; the server goes on with the next job
+                job['events'].put({'event': 'error', 'job': job['id'], 'message': '%s: %s' % (type(e).__name__, e)})
+            finally:
+                job['events'].put(None)
+
+    def run_job(self, job):
+        """
+        Solve one job like batch_main() solves a cohort, reporting each trial as it is done.
+        """
+        request = job['request']
+        params = {key.lower(): value for key, value in request.get('parameters', {}).items()}
+        if 'time_limit' in request:
+            params['time_limit'] = request['time_limit']
+        allocator = Allocator(**params)
+        trials = request.get('trials', NUM_TRIALS)
+        if trials is None and allocator.time_limit is None and allocator.patience is None and allocator.solver != 'classes':
+            raise ValueError("An unlimited number of trials needs TIME_LIMIT or PATIENCE.")
+        if trials is not None and trials < 1:
+            raise ValueError("A job needs a number of trials of at least one.")
+        cached = self.load(allocator, request['netids'], request['preferences'])
+        seed = request.get('seed', SEED)
+        base_seed = seed if seed is not None else allocator.random.randrange(2 ** 32)
+        job['events'].put({'event': 'started', 'job': job['id'], 'base_seed': base_seed, 'cached_roster': cached})
+
+        def report_trial(trial, value, metrics):
+            job['events'].put({'event': 'trial', 'job': job['id'], 'trial': trial, 'seed': metrics['seed'],
+                               'value': value if value > NEGATIVE_INFINITY else None})
+
+        self.share_workers(allocator, True)
+        try:
+            if allocator.solver == 'classes':  # Exact, so one job seeded like solve() does
+                results = [self.pool.submit(run_worker_trial, base_seed, False, 0, None, allocator).result()]
+            else:
+                results = allocator.trial_results(base_seed, trials, self.pool)
+            value = allocator.collect(base_seed, results, trials, report_trial)
+        finally:
+            self.share_workers(allocator, False)
+
+        result = {'event': 'done', 'job': job['id'], 'value': None, 'upper_bound': allocator.metrics['upper_bound'],
+                  'groups': []}
+        if value > NEGATIVE_INFINITY:
+            result['value'] = value
+            # Same as the output file: NetIDs of each project group, and its topic (1-indexed)
+            result['groups'] = [{'members': [allocator.netids[person_id] for group_id in members
+                                             for person_id in allocator.groups[group_id]],
+                                 'topic': topic + 1} for members, topic in allocator.project_groups]
+            if request.get('output'):
+                os.makedirs(os.path.dirname(request['output']), exist_ok=True)
+                allocator.write(request['output'])
+                result['output'] = request['output']
+        job['events'].put(result)
+
+
+class AllocationRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP interface of the allocation server (see README): POST /solve streams the events of a new job, one JSON object
+    per line, and GET /status describes the server.
+    """
+    def send_json(self, code, data):
+        body = (json.dumps(data) + '\n').encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != '/status':
+            return self.send_json(404, {'error': 'Unknown path %s.' % self.path})
+        self.send_json(200, self.server.allocation_server.status())
+
+    def do_POST(self):
+        if self.path != '/solve':
+            return self.send_json(404, {'error': 'Unknown path %s.' % self.path})
+        if self.headers.get_content_type() != 'application/json':
+            return self.send_json(415, {'error': 'Jobs need to be posted as application/json.'})
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            self.server.allocation_server.check(request)
+        except ValueError as e:
+            return self.send_json(400, {'error': str(e)})
+        job = self.server.allocation_server.submit(request)
+        if job is None:
+            return self.send_json(503, {'error': 'Too many jobs waiting, try again later.'})
+
+        # Stream the events of the job until it ends (the response ends when the connection closes)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        while True:
+            event = job['events'].get()
+            if event is None:
+                break
+            self.wfile.write((json.dumps(event) + '\n').encode())
+            self.wfile.flush()
 
 
 def main():
-    read_netids(NETID_FILENAME)
-    read_prefs(PREFERENCE_FILENAME)
-
-    max_value = NEGATIVE_INFINITY
-    project_groups = []
-    current_groups, current_prefs = [], []
-    global groups, prefs
-    for i in range(NUM_TRIALS):
-        print("[Trial %d / %d]" % (i+1, NUM_TRIALS))
-        value, proj_group = run()
-        #print(value)
-        if value > max_value:
-            max_value = value
-            project_groups = proj_group
-            current_groups = list(groups)  # Keep track of this since it gets reshuffled later
-            current_prefs = list(prefs)
-        print()
+    allocator = Allocator()
+    allocator.load(NETID_FILENAME, PREFERENCE_FILENAME)
+    if allocator.solve(NUM_TRIALS, SEED) > NEGATIVE_INFINITY:
+        allocator.write(OUTPUT_FILENAME)
+        print("Detailed group allocation written to %s." % OUTPUT_FILENAME)
 
+    if METRICS_FILENAME is not None:
+        with open(METRICS_FILENAME, 'w') as f:
+            json.dump(allocator.metrics, f, indent=1)
+        print("Metrics written to %s." % METRICS_FILENAME)
+
+
+def resume_main(checkpoint=None):
+    """
+    Continue an interrupted trial from its checkpoint file, and write its allocation.
+    :param checkpoint: Name of checkpoint file, or seed of the trial to put in place of '%s' in CHECKPOINT_FILENAME
+        (as when it was written, e.g. 0-2 for the third trial with SEED = 0); if None, CHECKPOINT_FILENAME itself
+    """
+    if checkpoint is not None and os.path.exists(checkpoint):
+        filename = checkpoint
+    elif CHECKPOINT_FILENAME is None:
+        print("ERROR: Set CHECKPOINT_FILENAME, or give the name of the checkpoint file to resume.")
+        return
+    elif '%s' in CHECKPOINT_FILENAME:
+        if checkpoint is None:
+            print("ERROR: CHECKPOINT_FILENAME has one file per trial, give the seed of the trial to resume "
+                  "(python main.py resume SEED) or the name of its file.")
+            return
+        filename = CHECKPOINT_FILENAME.replace('%s', checkpoint)  # Same as in dp
+    elif checkpoint is None:
+        filename = CHECKPOINT_FILENAME
+    else:
+        print("ERROR: Checkpoint file %s not found." % checkpoint)
+        return
+    if not os.path.exists(filename):
+        print("ERROR: Checkpoint file %s not found." % filename)
+        return
+
+    allocator = Allocator()
+    allocator.read_netids(NETID_FILENAME)
+    max_value, project_groups = allocator.resume(filename)
     if max_value <= NEGATIVE_INFINITY:
         print("ERROR: No valid group allocations found.")
         return
-
-    print("Optimal group allocation has an objective score of %d." % max_value)
-    groups = current_groups
-    prefs = current_prefs
-    output(project_groups, OUTPUT_FILENAME)
+    print("Group allocation from this trial has an objective score of %d." % max_value)
+    allocator.output(project_groups, OUTPUT_FILENAME)
     print("Detailed group allocation written to %s." % OUTPUT_FILENAME)
 
 
+def batch_main(manifest_filename):
+    """
+    Allocate several cohorts (e.g. all sections of a term) in one invocation.
+    The trials of all cohorts share one pool of NUM_WORKERS worker processes, and the largest cohorts are scheduled first,
+    so the whole batch takes about as long as its largest cohort once there are enough workers.
+    Each cohort's allocation is written as soon as all of its trials are done; the trials of a cohort that have not
+    started yet are dropped once its best allocation is within GAP_TOLERANCE of its upper bound (see upper_bound),
+    leaving the workers to the other cohorts.
+    :param manifest_filename: Name of manifest file, a JSON list with one object per cohort (see README)
+    """
+    with open(manifest_filename) as f:
+        manifest = json.load(f)
+    manifest_dir = os.path.dirname(manifest_filename)
+
+    cohorts = []
+    for entry in manifest:
+        name = entry.get('name', entry['output'])
+        print("Reading cohort %s" % name)
+        params = {key.lower(): value for key, value in entry.get('parameters', {}).items()}
+        allocator = Allocator(**params)
+        allocator.load(os.path.join(manifest_dir, entry['netids']), os.path.join(manifest_dir, entry['preferences']))
+        trials = entry.get('trials', NUM_TRIALS)
+        if trials is None or trials < 1:
+            raise ValueError("Cohort %s needs a number of trials of at least one." % name)
+        seed = entry.get('seed', SEED)
+        base_seed = seed if seed is not None else allocator.random.randrange(2 ** 32)
+        if allocator.solver == 'classes':  # Exact, so one job seeded like solve() does
+            seeds = [base_seed]
+        else:
+            seeds = [trial_seed(base_seed, i) for i in range(trials)]
+            if allocator.gap_tolerance is not None:
+                with timed(allocator.metrics['phases'], 'upper_bound'):
+                    allocator.bound = allocator.upper_bound()
+        cohorts.append({
+            'name': name,
+            'allocator': allocator,
+            'output': os.path.join(manifest_dir, entry['output']),
+            'base_seed': base_seed,
+            'seeds': seeds,
+            'results': [None] * len(seeds),  # None for trials that were dropped
+            'remaining': len(seeds),
+        })
+    print()
+
+    start_time = time.perf_counter()
+    pool = ProcessPoolExecutor(max_workers=NUM_WORKERS, initializer=init_worker,
+                               initargs=([cohort['allocator'] for cohort in cohorts],))
+    pending = deque((c, i) for c in sorted(range(len(cohorts)), key=lambda c: -len(cohorts[c]['allocator'].netids))
+                    for i in range(len(cohorts[c]['seeds'])))  # Largest cohorts first
+    jobs = {}
+    while pending or jobs:
+        # Trials are only submitted when a worker is free, so that dropped ones never start
+        while pending and len(jobs) < NUM_WORKERS:
+            c, i = pending.popleft()
+            jobs[pool.submit(run_worker_trial, cohorts[c]['seeds'][i], False, c)] = c, i
+        done, _ = wait(jobs, return_when=FIRST_COMPLETED)
+        job = done.pop()
+        c, i = jobs.pop(job)
+        cohort = cohorts[c]
+        allocator = cohort['allocator']
+        cohort['results'][i] = job.result()
+        cohort['remaining'] -= 1
+        bound = allocator.bound
+        if bound is not None and NEGATIVE_INFINITY < bound - allocator.gap_tolerance <= cohort['results'][i][0]:
+            num_pending = len(pending)
+            pending = deque(trial for trial in pending if trial[0] != c)
+            cohort['remaining'] -= num_pending - len(pending)
+        if cohort['remaining'] > 0:
+            continue
+        print("===== Cohort %s (base random seed %d) =====" % (cohort['name'], cohort['base_seed']))
+        results = [result for result in cohort['results'] if result is not None]
+        if allocator.collect(cohort['base_seed'], results, len(cohort['seeds'])) > NEGATIVE_INFINITY:
+            allocator.write(cohort['output'])
+            print("Detailed group allocation written to %s." % cohort['output'])
+        print()
+        cohort['results'] = None  # Free the allocations of the other trials
+        cohort['finished'] = time.perf_counter() - start_time
+    pool.shutdown()
+
+    # Trial time is the total time spent on a cohort's trials (across workers);
+    # finished is the time from the start of the first trial until the cohort's allocation was written
+    name_width = max([len('Cohort')] + [len(cohort['name']) for cohort in cohorts])
+    print("%-*s %8s %10s %7s %14s %12s" % (name_width, 'Cohort', 'Students', 'Objective', 'Trials', 'Trial time (s)',
+                                          'Finished (s)'))
+    for cohort in cohorts:
+        allocator = cohort['allocator']
+        value = allocator.value if allocator.value > NEGATIVE_INFINITY else 'infeasible'
+        trial_time = sum(sum(metrics['phases'].values()) for metrics in allocator.metrics['trials'])
+        print("%-*s %8d %10s %7d %14.2f %12.2f" % (name_width, cohort['name'], len(allocator.netids), value,
+                                                  len(allocator.metrics['trials']), trial_time, cohort['finished']))
+    print("Total time: %.2f s" % (time.perf_counter() - start_time))
+
+    if METRICS_FILENAME is not None:
+        with open(METRICS_FILENAME, 'w') as f:
+            json.dump({cohort['name']: cohort['allocator'].metrics for cohort in cohorts}, f, indent=1)
+        print("Metrics written to %s." % METRICS_FILENAME)
+
+
+def serve_main(port=SERVE_PORT):
+    """
+    Run the allocation server on localhost until Ctrl+C is pressed or it is terminated (see AllocationServer and README).
+    Trials of all jobs run on one pool of NUM_WORKERS worker processes (at least one).
+    :param port: Port to listen on
+    """
+    signal.signal(signal.SIGTERM, signal.default_int_handler)  # Stop the same way as on Ctrl+C
+    allocation_server = AllocationServer(max(1, NUM_WORKERS))
+    http_server = ThreadingHTTPServer(('127.0.0.1', port), AllocationRequestHandler)
+    http_server.allocation_server = allocation_server
+    print("Allocation server listening on http://127.0.0.1:%d (Ctrl+C to stop)." % port)
+    try:
+        http_server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopping allocation server.")
+    finally:
+        http_server.server_close()
+        allocation_server.pool.shutdown(cancel_futures=True)
+
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    if sys.argv[1:2] == ['resume'] and len(sys.argv) <= 3:
+        resume_main(sys.argv[2] if len(sys.argv) == 3 else None)
+    elif sys.argv[1:2] == ['batch'] and len(sys.argv) == 3:
+        batch_main(sys.argv[2])
+    elif sys.argv[1:2] == ['serve'] and len(sys.argv) <= 3:
+        serve_main(int(sys.argv[2]) if len(sys.argv) == 3 else SERVE_PORT)
+    else:
+        main()
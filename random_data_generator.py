@@ -12,41 +12,59 @@ def rand_string(len):
         s += chr(ord('a') + random.randint(0, 25))
     return s
 
-def rand_preference(len=3):
+def rand_preference(num_topics, topic_distr, len=3):
     pref = []
     for i in range(len):
-        x = random.choices(list(range(NUM_TOPICS)), TOPIC_DISTR)[0]
+        x = random.choices(list(range(num_topics)), topic_distr)[0]
         while x in pref:
-            x = random.choices(list(range(NUM_TOPICS)), TOPIC_DISTR)[0]
+            x = random.choices(list(range(num_topics)), topic_distr)[0]
         pref.append(x)
     return pref
 
-netids = []
-for i in range(NUM_STUDENTS):
-    s = rand_string(random.randint(3, 5))
-    while s in netids:
+def generate(netid_filename='test_netids.txt', pref_filename='test_preferences.txt', num_students=NUM_STUDENTS,
+             num_topics=NUM_TOPICS, topic_distr=TOPIC_DISTR, find_group_prob=FIND_GROUP_PROB, ignore_prob=IGNORE_PROB,
+             seed=None):
+    """
+    Generate random NetIDs and preferences, and write them to files in the input format of main.py.
+    Topic choice 0 is written as "0", which main.py reads as "non-specified".
+    :param num_topics: Number of options, including the "non-specified" option 0
+    :param topic_distr: Relative weight of each option in preferences
+    :param find_group_prob: Probability that a student submits with a partner
+    :param ignore_prob: Probability that a student (or pair) does not submit preferences
+    :param seed: Random seed (None: not seeded)
+    """
+    if seed is not None:
+        random.seed(seed)
+
+    netids = []
+    for i in range(num_students):
         s = rand_string(random.randint(3, 5))
-    netids.append(s)
-
-remain_ids = list(range(NUM_STUDENTS))
-groups = []
-prefs = []
-while remain_ids:
-    x = remain_ids[0]
-    group = [x]
-    r = random.random()
-    if len(remain_ids) > 1 and r < FIND_GROUP_PROB:  # Form a group
-        y = random.choice(remain_ids[1:])
-        group.append(y)
-    remain_ids = [i for i in remain_ids if i not in group]
-    if r < 1 - IGNORE_PROB:
-        groups.append(group)
-        prefs.append(rand_preference())
-
-with open('test_netids.txt', 'w') as f:
-    f.write('\n'.join(netids))
-
-with open('test_preferences.txt', 'w') as f:
-    for i in range(len(groups)):
-        items = [netids[id] for id in groups[i]] + [str(x) for x in prefs[i]]
-        f.write(', '.join(items) + '\n')
+        while s in netids:
+            s = rand_string(random.randint(3, 5))
+        netids.append(s)
+
+    remain_ids = list(range(num_students))
+    groups = []
+    prefs = []
+    while remain_ids:
+        x = remain_ids[0]
+        group = [x]
+        r = random.random()
+        if len(remain_ids) > 1 and r < find_group_prob:  # Form a group
+            y = random.choice(remain_ids[1:])
+            group.append(y)
+        remain_ids = [i for i in remain_ids if i not in group]
+        if r < 1 - ignore_prob:
+            groups.append(group)
+            prefs.append(rand_preference(num_topics, topic_distr))
+
+    with open(netid_filename, 'w') as f:
+        f.write('\n'.join(netids))
+
+    with open(pref_filename, 'w') as f:
+        for i in range(len(groups)):
+            items = [netids[id] for id in groups[i]] + [str(x) for x in prefs[i]]
+            f.write(', '.join(items) + '\n')
+
+if __name__ == '__main__':
+    generate()